@@ -1,47 +1,401 @@
+import io
 import os
 import shutil
 import re
+import hashlib
+import sqlite3
+import tarfile
+import glob
+import numpy as np
+import profiling
 
+from collections import deque
+from contextlib import closing, nullcontext
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Iterable, Iterator, Optional
 from PIL import Image
+from near_duplicates import NearDuplicateIndex, hash_methods, perceptual_hash
 
 
 _valid_extensions = ['.jpg', '.JPG', '.jpeg', '.JPEG']
 _valid_image_modes = ['RGB', 'L']
 _max_file_size = 250_000 # in bytes
+_index_file_name = 'validation_index.sqlite'
+_index_version = 3
+_chunk_size = 16 # files sent to a worker process at once
+_shard_name_format = 'shard-{:06d}.tar'
+_shard_index_file_name = 'shards.csv'
 
 
-def _scan_dir(dir: str, file_paths: list[str]) -> None:
+def _sorted_entries(dir: str) -> list[os.DirEntry]:
     """
-    Scans ``dir`` directory recursively and searches for files.
+    Lists the entries of ``dir`` directory in the order their paths (and the
+    paths of the files within them) would have in a sorted list of paths.
+    """
+    with os.scandir(dir) as entries:
+        # a directory is sorted as its name followed by the path separator,
+        # i.e. the common prefix of all paths within it
+        return sorted(entries, key=lambda entry: entry.name + os.sep if entry.is_dir() else entry.name)
+
+
+def _scan_dir(dir: str) -> Iterator[os.DirEntry]:
+    """
+    Scans ``dir`` directory iteratively and yields the entries of all files
+    within it and its subdirectories. The files are yielded in the order of
+    their sorted absolute paths, but only the entries of the directories on
+    the current path are held in memory.
 
     :param dir: Relative or absolute path to the directory.
-    :param file_paths: An empty list where the strings representing files'
-        absolute paths will be appended to.
     """
-    for file in os.scandir(dir):
-        if file.is_file():
-            file_paths.append(os.path.abspath(file.path))
+    stack = [iter(_sorted_entries(os.path.abspath(dir)))]
+    while stack:
+        entry = next(stack[-1], None)
+        if entry is None:
+            stack.pop()
+        elif entry.is_file():
+            yield entry
+        elif entry.is_dir():
+            stack.append(iter(_sorted_entries(entry.path)))
+
+
+def _image_pixels(image: Image.Image) -> np.ndarray:
+    """
+    Decodes ``image`` into a NumPy ``ndarray`` of (H * W, C) shape, where C is
+    the number of channels (3 for 'RGB' and 1 for 'L' images).
+
+    :param image: image (object of type ``PIL.Image.Image``) to be decoded
+    """
+    pixels = np.asarray(image)
+    return pixels.reshape(-1, len(image.getbands()))
+
+
+def _is_image_variance_valid(pixels: np.ndarray) -> bool:
+    """
+    Checks whether the image is not a solid colour, i.e. whether at least one
+    channel has different minimum and maximum values.
+
+    :param pixels: pixel data of (H * W, C) shape as returned by
+        ``_image_pixels``
+    """
+    # min == max holds for every channel exactly when all pixels are equal to
+    # the first one, which needs a single pass instead of two reductions
+    return bool((pixels != pixels[0]).any())
+
+
+def _image_digest(image: Image.Image, pixels: np.ndarray) -> bytes:
+    """
+    Computes a BLAKE2b digest of the image's mode, size and raw pixel data.
+    Two images have the same digest only if they have the same pixels.
+
+    :param image: image (object of type ``PIL.Image.Image``) ``pixels`` were
+        decoded from
+    :param pixels: pixel data as returned by ``_image_pixels``
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f'{image.mode};{image.size[0]}x{image.size[1]};'.encode())
+    digest.update(np.ascontiguousarray(pixels))
+    return digest.digest()
+
+
+def _check_image(file: tuple[str, tuple[Optional[int], Optional[int]]],
+                 hash_method: Optional[str] = None, keep_data: bool = False) \
+        -> tuple[int, Optional[bytes], Optional[int], Optional[bytes]]:
+    """
+    Checks a file against the validation rules 1 to 5 of ``validate_images``
+    and computes the image digest (and perceptual hash) needed for rule 6.
+    The file is read once and closed right away, and the image is decoded
+    once into a pixel buffer that all checks share.
+
+    :param file: a tuple of the absolute path to the file to be checked and its
+        stat key as returned by ``_stat_key``. The size is only used if the
+        file passes rule 1, so it can be ``None`` for files with an invalid
+        extension.
+    :param hash_method: optional perceptual hash method (see
+        ``near_duplicates.perceptual_hash``). If ``None``, no perceptual hash
+        is computed.
+    :param keep_data: optional flag. If ``True``, the content of a valid file
+        is returned, so that it can be written to the output without reading
+        the file again.
+    :return: a tuple of the number of the first violated rule (``0`` if the
+        file is valid), the image digest, the perceptual hash and the file
+        content (all ``None`` if the file is invalid, the content also if
+        ``keep_data`` is ``False``).
+    """
+    file_path, (file_size, _) = file
+    file_ext = os.path.splitext(file_path)[1]
+    if file_ext not in _valid_extensions:
+        return 1, None, None, None
+
+    if file_size > _max_file_size:
+        return 2, None, None, None
+
+    try:
+        with profiling.stage('validate_images.open'):
+            with open(file_path, 'rb') as f:
+                data = f.read()
+            image = Image.open(io.BytesIO(data))
+    except Exception:
+        # not BaseException: an interrupted read must not be recorded as rule 3
+        return 3, None, None, None
+    profiling.count('bytes_read', len(data), stage='validate_images')
+
+    with image:
+        if image.size[0] < 100 or image.size[1] < 100 \
+                or image.mode not in _valid_image_modes:
+            return 4, None, None, None
+
+        try:
+            with profiling.stage('validate_images.decode'):
+                pixels = _image_pixels(image)
+        except Exception:
+            # e.g. a truncated file, whose header could still be read
+            return 3, None, None, None
+        if not _is_image_variance_valid(pixels):
+            return 5, None, None, None
+
+        with profiling.stage('validate_images.hash'):
+            # the image is decoded already, so this only downscales it
+            image_phash = perceptual_hash(image, hash_method) if hash_method is not None else None
+            image_digest = _image_digest(image, pixels)
+    return 0, image_digest, image_phash, data if keep_data else None
+
+
+def _check_chunk(files: list[tuple], hash_method: Optional[str], profile: bool) \
+        -> tuple[list[tuple[int, Optional[bytes], Optional[int], None]], Optional[dict]]:
+    """
+    Runs ``_check_image`` for every file in ``files`` in a worker process.
+    If ``profile`` is ``True``, the profiling data recorded meanwhile is
+    returned along with the results, so that the parent process can merge it.
+    """
+    if not profile:
+        return [_check_image(file, hash_method) for file in files], None
+    profiling.enable()
+    profiling.reset()
+    results = [_check_image(file, hash_method) for file in files]
+    return results, profiling.snapshot()
+
+
+def _check_images(files: Iterable[tuple], workers: int, hash_method: Optional[str]) \
+        -> Iterator[tuple[tuple, tuple[int, Optional[bytes], Optional[int], Optional[bytes]]]]:
+    """
+    Runs ``_check_image`` for every file in ``files`` either serially or on a
+    pool of ``workers`` processes and yields the files along with their
+    results. The results are yielded in the order of ``files`` in both cases,
+    and ``files`` is consumed lazily, at most a few chunks per worker ahead.
+    Only serial runs return the content of valid files: sending it from the
+    workers would cost more than reading it from the page cache again.
+    """
+    if workers == 1:
+        for file in files:
+            yield file, _check_image(file, hash_method, keep_data=True)
+        return
+
+    files = iter(files)
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        while True:
+            chunk = list(islice(files, _chunk_size))
+            if chunk:
+                pending.append((chunk, executor.submit(_check_chunk, chunk, hash_method,
+                                                       profiling.is_enabled())))
+            # a few chunks per worker keep the pool busy while bounding the
+            # number of files read ahead of the results
+            while pending and (not chunk or len(pending) >= workers * 4):
+                done_chunk, future = pending.popleft()
+                results, profile = future.result()
+                if profile is not None:
+                    profiling.merge(profile)
+                yield from zip(done_chunk, results)
+            if not chunk:
+                return
+
+
+class _ShardWriter:
+    """
+    Packs images into uncompressed tar shards of at most ``shard_size``
+    images each in ``output_dir``. Every image is stored as ``<name>.jpg``
+    followed by its label as ``<name>.cls``, and ``shards.csv`` records the
+    shard, data offset and size of every image, so that single images can
+    be read without scanning a shard. Shards are written under a temporary
+    name and renamed once complete. Used as a context manager, the last shard
+    is completed on success, and the incomplete one is removed on errors.
+    """
+
+    def __init__(self, output_dir: str, shard_size: int) -> None:
+        self.output_dir = output_dir
+        self.shard_size = shard_size
+        # shards of a previous run would otherwise mix with the new ones, and
+        # incomplete shards of an interrupted run would be left behind
+        for pattern in ('shard-*.tar', 'shard-*.tar.tmp'):
+            for old_shard in glob.glob(os.path.join(glob.escape(output_dir), pattern)):
+                os.remove(old_shard)
+        self._index_f = open(os.path.join(output_dir, _shard_index_file_name), 'w')
+        self._index_f.write('name;shard;offset;size\n')
+        self._shard = None
+        self._shard_name = None
+        self._shard_count = 0
+        self._images_in_shard = 0
+
+    def _add_member(self, name: str, data: bytes) -> int:
+        """
+        Adds a member with ``data`` to the current shard and returns the
+        offset of the data in the shard file.
+        """
+        member = tarfile.TarInfo(name)
+        member.size = len(data)
+        self._shard.addfile(member, io.BytesIO(data))
+        # the data ends the shard so far, padded to whole blocks
+        return self._shard.offset - -(-len(data) // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+
+    def add(self, name: str, label: str, file_path: str, data: Optional[bytes] = None) -> None:
+        if self._shard is not None and self._images_in_shard == self.shard_size:
+            self._close_shard()
+        if self._shard is None:
+            self._shard_name = _shard_name_format.format(self._shard_count)
+            self._shard = tarfile.open(os.path.join(self.output_dir, self._shard_name + '.tmp'), 'w',
+                                       format=tarfile.USTAR_FORMAT)
+        if data is None:
+            with open(file_path, 'rb') as f:
+                data = f.read()
+        offset = self._add_member(name, data)
+        self._add_member(os.path.splitext(name)[0] + '.cls', label.encode())
+        self._index_f.write(f'{name};{self._shard_name};{offset};{len(data)}\n')
+        self._images_in_shard += 1
+
+    def _close_shard(self) -> None:
+        self._shard.close()
+        os.replace(os.path.join(self.output_dir, self._shard_name + '.tmp'),
+                   os.path.join(self.output_dir, self._shard_name))
+        self._shard = None
+        self._shard_count += 1
+        self._images_in_shard = 0
+
+    def close(self) -> None:
+        try:
+            if self._shard is not None:
+                self._close_shard()
+        finally:
+            self._index_f.close()
+
+    def abort(self) -> None:
+        """
+        Closes all files after an error and removes the incomplete shard.
+        """
+        try:
+            if self._shard is not None:
+                self._shard.close()
+                os.remove(os.path.join(self.output_dir, self._shard_name + '.tmp'))
+                self._shard = None
+        finally:
+            self._index_f.close()
+
+    def __enter__(self) -> '_ShardWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.close()
         else:
-            _scan_dir(file.path, file_paths)
+            self.abort()
+
+
+def _open_index(output_dir: str) -> sqlite3.Connection:
+    """
+    Opens (and creates if needed) the validation index in ``output_dir``. The
+    index stores the outcome of every processed file keyed by its path, so
+    that later incremental runs of ``validate_images`` can skip it.
+    """
+    index = sqlite3.connect(os.path.join(output_dir, _index_file_name))
+    if index.execute('PRAGMA user_version').fetchone()[0] != _index_version:
+        # an index of another version cannot be used for incremental runs
+        # anyway, so it is simply recreated
+        with index:
+            index.execute('DROP TABLE IF EXISTS files')
+            index.execute('DROP TABLE IF EXISTS meta')
+            index.execute(f'PRAGMA user_version = {_index_version}')
+    index.execute('CREATE TABLE IF NOT EXISTS files ('
+                  'path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, '
+                  'rule INTEGER NOT NULL, digest BLOB, phash BLOB, name TEXT)')
+    index.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+    return index
+
+
+def _load_index(index: sqlite3.Connection, formatter: str, hash_method: Optional[str],
+                image_phashes: NearDuplicateIndex) \
+        -> Optional[tuple[dict[str, tuple], set[bytes], int, dict[str, str]]]:
+    """
+    Loads the records of a previous run from ``index``. The perceptual hashes
+    of the copied images are added to ``image_phashes``.
+
+    :return: ``None`` if the index is empty or was written with another
+        ``formatter`` or ``hash_method``. Otherwise, a tuple of:
+        1.) a dictionary mapping paths to their (size, mtime_ns) stat keys;
+        2.) the set of digests of the copied images;
+        3.) the index the next new file gets its output name from;
+        4.) the meta data, including the lengths of ``labels.csv``
+            (``labels_size``) and of the log file (``log_file``,
+            ``log_size``) when the index was committed.
+    """
+    meta = dict(index.execute('SELECT key, value FROM meta'))
+    if 'next_index' not in meta or meta['formatter'] != formatter \
+            or meta['hash_method'] != (hash_method or ''):
+        return None
+
+    stat_keys = {}
+    image_digests = set()
+    for path, size, mtime_ns, rule, digest, phash in \
+            index.execute('SELECT path, size, mtime_ns, rule, digest, phash FROM files'):
+        stat_keys[path] = (size, mtime_ns)
+        if rule == 0:
+            image_digests.add(digest)
+            if phash is not None:
+                image_phashes.add(int.from_bytes(phash, 'big'))
+    return stat_keys, image_digests, int(meta['next_index']), meta
+
+
+def _truncate(file: str, size: int) -> None:
+    """
+    Truncates ``file`` to ``size`` bytes if it is longer, i.e. drops what an
+    interrupted run appended after the index was last committed.
+    """
+    try:
+        if os.path.getsize(file) > size:
+            os.truncate(file, size)
+    except FileNotFoundError:
+        pass
 
 
-def _is_image_variance_valid(image: Image.Image) -> bool:
+def _stat_key(entry: os.DirEntry) -> tuple[Optional[int], Optional[int]]:
     """
-    Checks whether the ``image`` is not a solid colour.
-    
-    :param image: image (object of type ``PIL.Image.Image``) to be checked
+    Returns the (size, mtime_ns) pair the index uses to detect changed files.
+    Files with an invalid extension are never decoded, so they are not
+    stat-ed and get ``(None, None)``.
     """
-    r_channel = list(image.getdata(0))
-    r_channel_var = (max(r_channel) - min(r_channel))
-    b_channel = list(image.getdata(1))
-    b_channel_var = (max(b_channel) - min(b_channel))
-    g_channel = list(image.getdata(2))
-    g_channel_var = (max(g_channel) - min(g_channel))
-    return not (r_channel_var == b_channel_var == g_channel_var == 0)
+    if os.path.splitext(entry.name)[1] not in _valid_extensions:
+        return None, None
+    stat = entry.stat()
+    return stat.st_size, stat.st_mtime_ns
+
 
+def _changed_files(input_dir: str, stat_keys: dict[str, tuple]) -> Iterator[tuple]:
+    """
+    Yields the paths and stat keys of the files in ``input_dir`` that are not
+    in ``stat_keys`` or whose stat key differs from the recorded one.
+    """
+    for entry in _scan_dir(input_dir):
+        stat_key = _stat_key(entry)
+        if stat_keys.get(entry.path) != stat_key:
+            yield entry.path, stat_key
 
+
+@profiling.timed('validate_images')
 def validate_images(input_dir: str, output_dir: str,
-                    log_file: str, formatter: str = '07d') -> int:
+                    log_file: str, formatter: str = '07d',
+                    workers: int = 1, incremental: bool = False,
+                    near_duplicate_threshold: Optional[int] = None,
+                    hash_method: str = 'dhash',
+                    shard_size: Optional[int] = None) -> int:
     """
     Validates images, copies valid images into the ``output_dir`` directory and
     then gives names to the copied images based on ``formatter``. It also writes
@@ -60,7 +414,9 @@ def validate_images(input_dir: str, output_dir: str,
            same width and height restrictions.
         5. The image data has a variance larger than 0, i.e., there is not just one common pixel in
            the image data.
-        6. The same image has not been copied already.
+        6. The same image has not been copied already. If
+           ``near_duplicate_threshold`` is given, this also covers images
+           whose perceptual hash is within the threshold of a copied one's.
 
     :param input_dir: Relative or absolute path to the directory where images
         will be looked for recursively.
@@ -74,66 +430,155 @@ def validate_images(input_dir: str, output_dir: str,
     :param formatter: optional format string used when writing the base names
         of the output valid images. For ``07d``, images' names will look
         like this: ``0000001.jpg``, ``0000002.jpg``, ``0000010.jpg``, etc.
+    :param workers: optional number of processes the rules 1 to 5 and the image
+        digests are computed on. The results are collected in the order of the
+        sorted file paths, so the output names, ``labels.csv`` rows and log
+        lines are the same as with the default serial run (``1``).
+    :param incremental: optional flag. Every run records the outcome of each
+        file in ``validation_index.sqlite`` in ``output_dir``. If ``True`` and
+        such an index exists, only files that are new or whose size or
+        modification time changed are validated, and their results are
+        appended to ``labels.csv`` and ``log_file`` instead of rewriting them.
+        New valid images are numbered after all previously processed files,
+        and changed files are treated as new ones (previous copies are kept).
+        Without a usable index, a full run is performed. The index is
+        committed at the end of a run, so after an interrupted run the next
+        one continues from the last committed state.
+    :param near_duplicate_threshold: optional maximum Hamming distance (out of
+        64 bits) between the perceptual hashes of two images for them to be
+        treated as duplicates, e.g. re-encoded or resized copies. If ``None``
+        (the default), only images with identical pixel data are duplicates.
+    :param hash_method: optional perceptual hash method used with
+        ``near_duplicate_threshold``: ``ahash``, ``dhash`` (the default) or
+        ``phash``.
+    :param shard_size: optional maximum number of images per shard. If
+        given, the valid images are not copied as single files, but packed
+        into ``shard-000000.tar``, ``shard-000001.tar``, etc. in
+        ``output_dir`` (see ``_ShardWriter``), which ``ShardedImagesDataset``
+        of assignment 3 reads sequentially. ``labels.csv`` is written as
+        usual, and ``shards.csv`` gives the shard, data offset and size of
+        every image.
     :raises ValueError: If ``input_dir`` is a path to a nonexistent directory.
-    :return: number of valid copied images
+    :raises ValueError: If ``workers`` is less than 1.
+    :raises ValueError: If ``shard_size`` is less than 1 or used together
+        with ``incremental``, as finished shards are not appended to.
+    :raises ValueError: If ``near_duplicate_threshold`` is not in [0, 64] or
+        ``hash_method`` is unknown.
+    :return: number of valid images copied in this run (in incremental runs,
+        only the new ones)
     """
-    file_paths = []
     if not os.path.isdir(input_dir):
         raise ValueError(f'input_dir is not an existing directory')
-    _scan_dir(input_dir, file_paths)
-    file_paths = sorted(file_paths)
+    if workers < 1:
+        raise ValueError('workers should be >= 1')
+    if shard_size is not None:
+        if shard_size < 1:
+            raise ValueError('shard_size should be >= 1')
+        if incremental:
+            raise ValueError('shard_size cannot be used with incremental runs')
+    if near_duplicate_threshold is not None:
+        if not 0 <= near_duplicate_threshold <= 64:
+            raise ValueError('near_duplicate_threshold should be in [0, 64]')
+        if hash_method not in hash_methods:
+            raise ValueError(f'hash_method should be one of {hash_methods}')
+    else:
+        hash_method = None
 
     os.makedirs(output_dir, exist_ok=True)
     os.makedirs(os.path.split(log_file)[0], exist_ok=True)
 
+    index = _open_index(output_dir)
+    image_phashes = NearDuplicateIndex(near_duplicate_threshold or 0)
+    previous_run = _load_index(index, formatter, hash_method, image_phashes) if incremental else None
     labels_file = os.path.join(output_dir, 'labels.csv')
-    # add columns to the csv file
-    with open(labels_file, 'w') as labels_f:
-        labels_f.write('name;label\n')
+    if previous_run is None:
+        stat_keys, image_digests, next_index = {}, set(), 0
+        image_phashes = NearDuplicateIndex(near_duplicate_threshold or 0)
+        # the meta data goes in the same transaction, so that an interrupted
+        # full run leaves an empty index and the next run is a full one again
+        with index:
+            index.execute('DELETE FROM files')
+            index.execute('DELETE FROM meta')
+    else:
+        stat_keys, image_digests, next_index, meta = previous_run
+        # rows appended by an interrupted run belong to files that are not in
+        # the index, so they are validated and written again. Their output
+        # files get the same names and are overwritten.
+        _truncate(labels_file, int(meta['labels_size']))
+        if meta['log_file'] == os.path.abspath(log_file):
+            _truncate(log_file, int(meta['log_size']))
+
+    files = _changed_files(input_dir, stat_keys)
 
-    image_hashes = set()
+    if previous_run is None:
+        # add columns to the csv file
+        with open(labels_file, 'w') as labels_f:
+            labels_f.write('name;label\n')
 
-    with open(log_file, 'w') as log_f, open(labels_file, 'a') as labels_f:
-        for index, file_path in enumerate(file_paths):
+    copied = 0
+    log_mode = 'w' if previous_run is None else 'a'
+    # on exit, the last shard is completed before the index is committed, and
+    # the index is closed after being committed or rolled back
+    with (open(log_file, log_mode) as log_f,
+          open(labels_file, 'a') as labels_f,
+          closing(index), index,
+          _ShardWriter(output_dir, shard_size) if shard_size is not None else nullcontext() as shards):
+        for (file_path, stat_key), (rule, image_digest, image_phash, data) in \
+                _check_images(files, workers, hash_method):
             file_name = os.path.split(file_path)[1]
-            file_ext = os.path.splitext(file_path)[1]
-
-            if file_ext not in _valid_extensions:
-                log_f.write(f'{file_name},1\n')
-                continue
-
-            if os.path.getsize(file_path) > _max_file_size:
-                log_f.write(f'{file_name},2\n')
-                continue
-
-            try:
-                image = Image.open(file_path)
-            except:
-                log_f.write(f'{file_name},3\n')
-                continue
-
-            if image.size[0] < 100 or image.size[1] < 100 \
-                    or image.mode not in _valid_image_modes:
-                log_f.write(f'{file_name},4\n')
-                continue
-
-            if not _is_image_variance_valid(image):
-                log_f.write(f'{file_name},5\n')
-                continue
-            
-            image_hash = hash(tuple(image.getdata()))
-            if image_hash in image_hashes:
-                log_f.write(f'{file_name},6\n')
-                continue
-
-            formatted_name = ('{:' + formatter + '}').format(index) + '.jpg'
-            # delete all integers in a base file name without an extension
-            label = re.sub(r'\d+', '', os.path.splitext(file_name)[0])
-
-            labels_f.write(f'{formatted_name};{label}\n')
-            shutil.copy(file_path, os.path.join(output_dir, formatted_name))
-
-            image_hashes.add(image_hash)
-
-    return len(image_hashes)
+            formatted_name = None
+
+            # duplicates are resolved here rather than in _check_image so that
+            # the first image in the sorted order wins regardless of workers
+            if rule == 0 and image_digest in image_digests:
+                rule = 6
+            if rule == 0 and hash_method is not None \
+                    and image_phashes.find(image_phash) is not None:
+                rule = 6
+
+            profiling.count('validated_files', rule=rule)
+            if rule != 0:
+                log_f.write(f'{file_name},{rule}\n')
+            else:
+                formatted_name = ('{:' + formatter + '}').format(next_index) + '.jpg'
+                # delete all integers in a base file name without an extension
+                label = re.sub(r'\d+', '', os.path.splitext(file_name)[0])
+
+                labels_f.write(f'{formatted_name};{label}\n')
+                with profiling.stage('validate_images.copy'):
+                    if shards is not None:
+                        shards.add(formatted_name, label, file_path, data)
+                    elif data is not None:
+                        with open(os.path.join(output_dir, formatted_name), 'wb') as output_f:
+                            output_f.write(data)
+                    else:
+                        shutil.copy(file_path, os.path.join(output_dir, formatted_name))
+
+                image_digests.add(image_digest)
+                if hash_method is not None:
+                    image_phashes.add(image_phash)
+                copied += 1
+
+            if rule != 0:
+                image_digest = image_phash = None
+            index.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)',
+                          (file_path, *stat_key, rule, image_digest,
+                           image_phash.to_bytes(8, 'big') if image_phash is not None else None,
+                           formatted_name))
+            next_index += 1
+
+        # labels.csv and the log are written outside of the index, so the
+        # lengths they have once the index is committed are recorded with it
+        log_f.flush()
+        labels_f.flush()
+        index.executemany('INSERT OR REPLACE INTO meta VALUES (?, ?)', [
+            ('formatter', formatter),
+            ('hash_method', hash_method or ''),
+            ('next_index', str(next_index)),
+            ('labels_size', str(labels_f.tell())),
+            ('log_file', os.path.abspath(log_file)),
+            ('log_size', str(log_f.tell())),
+        ])
+
+    return copied
 
@@ -0,0 +1,130 @@
+import numpy as np
+
+from typing import Optional
+from PIL import Image
+
+
+hash_methods = ['ahash', 'dhash', 'phash']
+
+_hash_size = 8 # the hashes have _hash_size ** 2 = 64 bits
+_phash_image_size = 32
+
+
+def _dct_matrix(size: int) -> np.ndarray:
+    """
+    Returns the orthonormal DCT-II matrix ``M`` of ``size`` x ``size`` shape,
+    so that ``M @ x @ M.T`` is the 2D DCT of the square matrix ``x``.
+    """
+    k = np.arange(size)[:, None]
+    n = np.arange(size)[None, :]
+    matrix = np.sqrt(2 / size) * np.cos(np.pi * (2 * n + 1) * k / (2 * size))
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+
+_phash_dct = _dct_matrix(_phash_image_size)
+
+
+def _bits_to_int(bits: np.ndarray) -> int:
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), 'big')
+
+
+def perceptual_hash(image: Image.Image, method: str = 'dhash') -> int:
+    """
+    Computes a 64-bit perceptual hash of ``image``. Unlike a digest of the
+    pixel data, similar images (e.g. re-encoded or resized copies) get hashes
+    with a small Hamming distance.
+
+    :param image: image (object of type ``PIL.Image.Image``) to be hashed
+    :param method: one of:
+        - ``ahash``: each bit tells whether a pixel of the 8x8 downscaled
+          image is brighter than the mean;
+        - ``dhash``: each bit tells whether a pixel of the 9x8 downscaled
+          image is brighter than its left neighbour;
+        - ``phash``: each bit tells whether a coefficient of the 8x8 lowest
+          frequencies of the 32x32 downscaled image's DCT is larger than
+          their median.
+    :raises ValueError: if ``method`` is not one of ``hash_methods``.
+    :return: the hash as an integer in [0, 2 ** 64)
+    """
+    gray = image.convert('L')
+    if method == 'ahash':
+        pixels = np.asarray(gray.resize((_hash_size, _hash_size), Image.BILINEAR), dtype=np.float64)
+        return _bits_to_int(pixels > pixels.mean())
+    if method == 'dhash':
+        pixels = np.asarray(gray.resize((_hash_size + 1, _hash_size), Image.BILINEAR), dtype=np.int16)
+        return _bits_to_int(pixels[:, 1:] > pixels[:, :-1])
+    if method == 'phash':
+        pixels = np.asarray(gray.resize((_phash_image_size, _phash_image_size), Image.BILINEAR),
+                            dtype=np.float64)
+        dct = (_phash_dct @ pixels @ _phash_dct.T)[:_hash_size, :_hash_size]
+        # the DC coefficient only holds the mean brightness, so it is left out
+        # of the median
+        return _bits_to_int(dct > np.median(dct.ravel()[1:]))
+    raise ValueError(f'method should be one of {hash_methods}')
+
+
+def hamming_distance(hash_a: int, hash_b: int) -> int:
+    return (hash_a ^ hash_b).bit_count()
+
+
+class NearDuplicateIndex:
+    """
+    Multi-index hash table of 64-bit perceptual hashes for Hamming distance
+    lookups. The hashes are split into ``num_blocks`` blocks, each indexed by
+    its own table. If two hashes are within ``max_distance``, at least one of
+    their blocks is within ``max_distance // num_blocks`` (pigeonhole
+    principle), so a lookup only probes the few block values around the
+    query's blocks instead of comparing against every hash.
+    """
+
+    def __init__(self, max_distance: int, num_blocks: int = 4) -> None:
+        if 64 % num_blocks != 0:
+            raise ValueError('num_blocks should divide 64')
+        self._max_distance = max_distance
+        self._block_bits = 64 // num_blocks
+        self._block_mask = (1 << self._block_bits) - 1
+        self._tables: list[dict[int, list[int]]] = [{} for _ in range(num_blocks)]
+        self._hashes: set[int] = set()
+        # all bit masks with at most max_distance // num_blocks bits set that
+        # turn a block value into the values to probe
+        self._probe_masks = [0]
+        for _ in range(max_distance // num_blocks):
+            self._probe_masks = sorted({mask | (1 << bit)
+                                        for mask in self._probe_masks
+                                        for bit in range(self._block_bits)}
+                                       | set(self._probe_masks))
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+    def _blocks(self, hash_value: int) -> list[int]:
+        return [(hash_value >> (i * self._block_bits)) & self._block_mask
+                for i in range(len(self._tables))]
+
+    def add(self, hash_value: int) -> None:
+        """
+        Inserts ``hash_value`` into the index. Hashes already in the index are
+        ignored.
+        """
+        if hash_value in self._hashes:
+            return
+        self._hashes.add(hash_value)
+        for table, block in zip(self._tables, self._blocks(hash_value)):
+            table.setdefault(block, []).append(hash_value)
+
+    def find(self, hash_value: int) -> Optional[int]:
+        """
+        Searches for a hash within ``max_distance`` of ``hash_value``.
+
+        :return: any hash of the index within ``max_distance``, or ``None`` if
+            there is no such hash.
+        """
+        if hash_value in self._hashes:
+            return hash_value
+        for table, block in zip(self._tables, self._blocks(hash_value)):
+            for mask in self._probe_masks:
+                for candidate in table.get(block ^ mask, ()):
+                    if hamming_distance(hash_value, candidate) <= self._max_distance:
+                        return candidate
+        return None
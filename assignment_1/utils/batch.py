@@ -0,0 +1,102 @@
+"""
+Shared batch engine of the image utilities in this folder. It runs a per-image
+function over all images of a folder, either in this process or on a pool of
+processes, shows the progress with tqdm and can skip images whose output is
+already present and up to date (resumable runs).
+"""
+
+import contextlib
+import os
+import warnings
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable, Iterator
+
+from tqdm import tqdm
+
+supported_extensions = {".jpg", ".JPG", ".jpeg", ".JPEG"}
+
+
+def add_batch_arguments(parser) -> None:
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="The number of processes the images are processed on. Default: 1")
+    parser.add_argument("--resume", action="store_true",
+                        help="Skip images whose output file already exists and is not older than the input file.")
+
+
+def list_images(input_dir: str) -> list[str]:
+    return sorted(f.path for f in os.scandir(input_dir)
+                  if f.is_file() and os.path.splitext(f)[1] in supported_extensions)
+
+
+def is_up_to_date(input_file: str, output_file: str) -> bool:
+    try:
+        return os.path.getmtime(output_file) >= os.path.getmtime(input_file)
+    except FileNotFoundError:
+        return False
+
+
+@contextlib.contextmanager
+def atomic_output(output_file: str) -> Iterator[str]:
+    """
+    Yields a temporary path next to ``output_file`` that is renamed to
+    ``output_file`` once the block finishes without an exception, so that an
+    interrupted run never leaves a truncated output behind that ``--resume``
+    would take as up to date.
+    """
+    directory, file_name = os.path.split(output_file)
+    temp_file = os.path.join(directory, f".{file_name}.{os.getpid()}.tmp")
+    try:
+        yield temp_file
+        os.replace(temp_file, output_file)
+    finally:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+
+
+def run_batch(function: Callable, image_files: list[str], output_dir: str, jobs: int = 1,
+              resume: bool = False, **kwargs) -> tuple[dict, dict]:
+    """
+    Calls ``function(image_file, output_file, **kwargs)`` for every image in
+    ``image_files``, where ``output_file`` has the image's file name in
+    ``output_dir``. With ``jobs`` > 1, ``function`` and ``kwargs`` must be
+    picklable, i.e. ``function`` has to be defined at module level.
+
+    An exception raised for one image (e.g. an undecodable file) does not
+    stop the run: it is reported with a warning, and the remaining images
+    are processed. As failed images get no output, ``resume`` retries them.
+
+    :return: a tuple of two dictionaries, one mapping the processed image
+        files to the return values of ``function`` and one mapping the image
+        files that failed to their exceptions. Images skipped because of
+        ``resume`` are in neither.
+    """
+    if jobs < 1:
+        raise ValueError(f"jobs must be >= 1, but is {jobs}")
+    tasks = [(image_file, os.path.join(output_dir, os.path.basename(image_file))) for image_file in image_files]
+    if resume:
+        tasks = [(image_file, output_file) for image_file, output_file in tasks
+                 if not is_up_to_date(image_file, output_file)]
+
+    results = {}
+    failures = {}
+
+    def record(image_file: str, result: Callable) -> None:
+        try:
+            results[image_file] = result()
+        except Exception as e:
+            failures[image_file] = e
+            warnings.warn(f"could not process '{image_file}': {e!r}")
+
+    with tqdm(total=len(tasks), unit="file") as progress:
+        if jobs == 1:
+            for image_file, output_file in tasks:
+                record(image_file, lambda: function(image_file, output_file, **kwargs))
+                progress.update()
+        else:
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                futures = {executor.submit(function, image_file, output_file, **kwargs): image_file
+                           for image_file, output_file in tasks}
+                for future in as_completed(futures):
+                    record(futures[future], future.result)
+                    progress.update()
+    return results, failures
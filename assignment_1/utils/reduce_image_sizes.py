@@ -17,10 +17,11 @@ authors.
 
 This script will take a folder INPUT_DIR and reduce the image size of all .jpg
 images via two heuristics until the new image size is equal to or smaller than
-MAX_FILE_SIZE (bytes). Heuristic 1 is about repeatedly reducing the image
-quality until MIN_QUALITY is reached. If the image size is still too big,
-heuristic 2 is applied, where the resolution is repeatedly reduced. The
-resulting image files will be written to the folder OUTPUT_DIR. See the help
+MAX_FILE_SIZE (bytes). Heuristic 1 is about reducing the image quality in steps
+of 5 down to MIN_QUALITY. If the image size is still too big, heuristic 2 is
+applied, where the resolution is reduced in steps of 5%. Each heuristic
+binary-searches its steps for the highest one that fits, encoding into memory,
+so only the final image is written to the folder OUTPUT_DIR. See the help
 info text of the individual arguments for default values and further details.
 
 Usage: python reduce_image_sizes.py INPUT_DIR
@@ -28,65 +29,116 @@ Usage: python reduce_image_sizes.py INPUT_DIR
             [--max_file_size MAX_FILE_SIZE]
             [--min_quality MIN_QUALITY]
             [--resize_quality RESIZE_QUALITY]
+            [--jobs JOBS]
+            [--resume]
 """
 
 import argparse
+import io
 import os
 import shutil
 import warnings
+from typing import Callable, Optional
 
 from PIL import Image
-from tqdm import tqdm
-
-parser = argparse.ArgumentParser()
-parser.add_argument("input_dir", type=str, help="The directory containing the images.")
-parser.add_argument("--output_dir", type=str,
-                    help="The directory containing the resized images. If not specified, the original 'input_dir' with "
-                         "the additional postfix '_resized' will be used (directory will be created).")
-parser.add_argument("--max_file_size", type=int, default=250_000,
-                    help="Maximum allowed size in bytes up to which images are not resized. Default: 250kB")
-parser.add_argument("--min_quality", type=int, default=70,
-                    help="The minimum image quality when continuously reducing the quality to obtain smaller file "
-                         "sizes (heuristic 1). Default: 70")
-parser.add_argument("--resize_quality", type=int, default=95,
-                    help="The image quality when storing resized images (heuristic 2). Default: 95")
-args = parser.parse_args()
-
-input_dir = args.input_dir
-if not os.path.isdir(input_dir):
-    raise ValueError(f"'{input_dir}' must be an existing directory")
-output_dir = args.output_dir if args.output_dir is not None else input_dir + "_resized"
-os.makedirs(output_dir, exist_ok=True)
-supported_extensions = {".jpg", ".JPG", ".jpeg", ".JPEG"}
-image_files = [f.path for f in os.scandir(input_dir) if f.is_file() and os.path.splitext(f)[1] in supported_extensions]
-
-for i, image_file in tqdm(enumerate(image_files), total=len(image_files)):
-    file_name = os.path.basename(image_file)
-    file_size = os.path.getsize(image_file)
-    
-    if file_size > args.max_file_size:
-        # Start from 95% of the original image quality and resolution and reduce by 5% after each iteration
-        quality = 95
-        resize_factor = 0.95
-        new_file_size = file_size
-        new_image_file = os.path.join(output_dir, file_name)
-        
-        while new_file_size > args.max_file_size:
-            with Image.open(image_file) as image:
-                # Heuristic 1: Try to save the image with reduced quality (until some minimum is reached)
-                if quality >= args.min_quality:
-                    image.save(new_image_file, quality=quality)
-                    quality -= 5
-                # Heuristic 2: If reducing the quality still leads to too big image sizes, try reducing the resolution
-                else:
-                    if resize_factor <= 0:
-                        warnings.warn(f"resize_factor <= 0, could not reduce image size of '{image_file}'")
-                        os.remove(new_image_file)
-                        break
-                    new_width, new_height = int(image.width * resize_factor), int(image.height * resize_factor)
-                    new_image = image.resize((new_width, new_height))
-                    new_image.save(new_image_file, quality=args.resize_quality)
-                    resize_factor -= 0.05
-            new_file_size = os.path.getsize(new_image_file)
-    else:
-        shutil.copy(image_file, os.path.join(output_dir, file_name))
+
+from batch import add_batch_arguments, atomic_output, list_images, run_batch
+
+
+def encode_jpeg(image: Image.Image, quality: int) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def search_steps(steps: list, encode: Callable, max_file_size: int) -> Optional[bytes]:
+    """
+    Binary-searches ``steps`` (ordered from the largest to the smallest
+    resulting file size) for the first step whose encoded image does not
+    exceed ``max_file_size`` bytes and returns the encoded image, or ``None``
+    if even the last step is too big.
+    """
+    best = None
+    low, high = 0, len(steps)
+    while low < high:
+        middle = (low + high) // 2
+        data = encode(steps[middle])
+        if len(data) <= max_file_size:
+            best = data
+            high = middle
+        else:
+            low = middle + 1
+    return best
+
+
+def reduce_image_size(image_file: str, max_file_size: int, min_quality: int, resize_quality: int) -> Optional[bytes]:
+    """
+    Returns the JPEG data of ``image_file`` reduced to at most ``max_file_size``
+    bytes, or ``None`` if no quality and resolution step is small enough.
+    """
+    with Image.open(image_file) as image:
+        # decode the source once, all encodings below start from these pixels
+        image.load()
+        # Heuristic 1: Try to save the image with reduced quality (until some minimum is reached)
+        qualities = list(range(95, min_quality - 1, -5))
+        data = search_steps(qualities, lambda quality: encode_jpeg(image, quality), max_file_size)
+        if data is not None:
+            return data
+        # Heuristic 2: If reducing the quality still leads to too big image sizes, try reducing the resolution
+        resize_factors = [factor / 100 for factor in range(95, 0, -5)
+                          if int(image.width * factor / 100) > 0 and int(image.height * factor / 100) > 0]
+        return search_steps(
+            resize_factors,
+            lambda factor: encode_jpeg(image.resize((int(image.width * factor), int(image.height * factor))),
+                                       resize_quality),
+            max_file_size)
+
+
+def process_image(image_file: str, output_file: str, max_file_size: int, min_quality: int,
+                  resize_quality: int) -> bool:
+    """
+    Writes ``image_file`` to ``output_file``, reduced in size if it is bigger
+    than ``max_file_size``. Returns ``False`` if its size could not be reduced
+    enough, in which case nothing is written.
+    """
+    if os.path.getsize(image_file) <= max_file_size:
+        with atomic_output(output_file) as temp_file:
+            shutil.copy(image_file, temp_file)
+        return True
+    data = reduce_image_size(image_file, max_file_size, min_quality, resize_quality)
+    if data is None:
+        return False
+    with atomic_output(output_file) as temp_file, open(temp_file, "wb") as f:
+        f.write(data)
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input_dir", type=str, help="The directory containing the images.")
+    parser.add_argument("--output_dir", type=str,
+                        help="The directory containing the resized images. If not specified, the original 'input_dir' with "
+                             "the additional postfix '_resized' will be used (directory will be created).")
+    parser.add_argument("--max_file_size", type=int, default=250_000,
+                        help="Maximum allowed size in bytes up to which images are not resized. Default: 250kB")
+    parser.add_argument("--min_quality", type=int, default=70,
+                        help="The minimum image quality when continuously reducing the quality to obtain smaller file "
+                             "sizes (heuristic 1). Default: 70")
+    parser.add_argument("--resize_quality", type=int, default=95,
+                        help="The image quality when storing resized images (heuristic 2). Default: 95")
+    add_batch_arguments(parser)
+    args = parser.parse_args()
+
+    input_dir = args.input_dir
+    if not os.path.isdir(input_dir):
+        raise ValueError(f"'{input_dir}' must be an existing directory")
+    output_dir = args.output_dir if args.output_dir is not None else input_dir + "_resized"
+    os.makedirs(output_dir, exist_ok=True)
+
+    # failed images are reported by run_batch
+    results, _ = run_batch(process_image, list_images(input_dir), output_dir, jobs=args.jobs, resume=args.resume,
+                           max_file_size=args.max_file_size, min_quality=args.min_quality,
+                           resize_quality=args.resize_quality)
+    for image_file, reduced in results.items():
+        if not reduced:
+            warnings.warn(f"could not reduce image size of '{image_file}'")
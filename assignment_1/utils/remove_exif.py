@@ -1,30 +1,110 @@
 from PIL import Image
 
 import os
+import time
 import argparse
-from tqdm import tqdm
+from typing import Optional
 
+from batch import add_batch_arguments, atomic_output, list_images, run_batch
 
-arg_parser = argparse.ArgumentParser()
-arg_parser.add_argument("input_dir",
-                        type=str,
-                        help="The directory containing the images.")
-arg_parser.add_argument("--output_dir",
-                        type=str,
-                        help="The directory containing the resized images. If not specified, the original 'input_dir' with "
-                        "the additional postfix '_resized' will be used (directory will be created).")
+# APP1-APP15 and COM segments hold metadata (EXIF, XMP, ICC, IPTC, comments)
+# only, except APP14 (Adobe), which tells the decoder how to transform the
+# colours and therefore has to be kept along with APP0 (JFIF)
+_metadata_markers = {marker for marker in range(0xE1, 0xF0) if marker != 0xEE} | {0xFE}
+# markers without a length field
+_standalone_markers = set(range(0xD0, 0xD8)) | {0x01}
+_sos_marker = 0xDA
 
-args = arg_parser.parse_args()
 
-os.makedirs(args.output_dir, exist_ok=True)
-supported_extensions = {".jpg", ".JPG", ".jpeg", ".JPEG"}
-image_files = [f.path
-               for f in os.scandir(args.input_dir)
-               if f.is_file() and os.path.splitext(f)[1] in supported_extensions]
+def strip_jpeg_metadata(data: bytes) -> Optional[bytes]:
+    """
+    Removes the metadata segments from the JPEG file ``data`` by rewriting
+    its marker stream. The compressed image data is copied unchanged, so the
+    decoded pixels are bit for bit the same as the input's.
+
+    :return: the JPEG data without metadata, or ``None`` if ``data`` is not a
+        JPEG file with a well-formed marker stream.
+    """
+    if data[:2] != b"\xff\xd8":
+        return None
+    parts = [b"\xff\xd8"]
+    pos = 2
+    while pos < len(data):
+        if data[pos] != 0xFF:
+            return None
+        segment_start = pos
+        # any number of 0xFF fill bytes may precede a marker
+        while pos < len(data) and data[pos] == 0xFF:
+            pos += 1
+        if pos >= len(data):
+            return None
+        marker = data[pos]
+        pos += 1
+        if marker in _standalone_markers:
+            parts.append(data[segment_start:pos])
+            continue
+        if pos + 2 > len(data):
+            return None
+        segment_end = pos + int.from_bytes(data[pos:pos + 2], "big")
+        if segment_end > len(data) or segment_end < pos + 2:
+            return None
+        if marker == _sos_marker:
+            # from the first scan on, the data is copied up to the end of image
+            # marker, which cannot occur within the byte-stuffed scan data;
+            # anything appended after it (e.g. MPF preview images) is dropped
+            eoi = data.find(b"\xff\xd9", segment_end)
+            if eoi < 0:
+                return None
+            parts.append(data[segment_start:eoi + 2])
+            return b"".join(parts)
+        if marker not in _metadata_markers:
+            parts.append(data[segment_start:segment_end])
+        pos = segment_end
+    return None
+
+
+def remove_exif(image_file: str, output_file: str) -> bool:
+    """
+    Writes ``image_file`` without metadata to ``output_file``. JPEG files are
+    rewritten without decoding them. Other or malformed files are decoded and
+    re-encoded with Pillow instead.
+
+    :return: ``True`` if the fast path without decoding was taken
+    """
+    with open(image_file, "rb") as f:
+        data = strip_jpeg_metadata(f.read())
+    if data is not None:
+        with atomic_output(output_file) as temp_file, open(temp_file, "wb") as f:
+            f.write(data)
+        return True
 
-for image_file in tqdm(image_files):
-    file_name = os.path.basename(image_file)
     with Image.open(image_file) as image:
         new_image = Image.new(image.mode, image.size)
         new_image.putdata(image.getdata())
-        new_image.save(os.path.join(args.output_dir, file_name))
+        with atomic_output(output_file) as temp_file:
+            new_image.save(temp_file, format=image.format)
+    return False
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("input_dir",
+                            type=str,
+                            help="The directory containing the images.")
+    arg_parser.add_argument("--output_dir",
+                            type=str,
+                            help="The directory containing the resized images. If not specified, the original 'input_dir' with "
+                            "the additional postfix '_resized' will be used (directory will be created).")
+    add_batch_arguments(arg_parser)
+
+    args = arg_parser.parse_args()
+
+    output_dir = args.output_dir if args.output_dir is not None else args.input_dir + "_resized"
+    os.makedirs(output_dir, exist_ok=True)
+    start = time.perf_counter()
+    results, failures = run_batch(remove_exif, list_images(args.input_dir), output_dir, jobs=args.jobs,
+                                  resume=args.resume)
+    elapsed = time.perf_counter() - start
+    fast = sum(results.values())
+    print(f"{len(results)} files in {elapsed:.2f}s ({len(results) / max(elapsed, 1e-9):.1f} files/s), "
+          f"{fast} rewritten without decoding, {len(results) - fast} re-encoded, {len(failures)} failed")
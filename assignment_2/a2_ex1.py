@@ -1,11 +1,98 @@
 import numpy as np
 
 
-def to_grayscale(pil_image: np.ndarray) -> np.ndarray:
+_luminance_weights = (0.2126, 0.7152, 0.0722)
+
+
+def _gamma_expand(rgb_norm: np.ndarray) -> np.ndarray:
+    return np.where(rgb_norm <= 0.04045,
+                    rgb_norm / 12.92,
+                    ((rgb_norm + 0.055) / 1.055)**2.4)
+
+
+# linear luminance contribution of every uint8 value of the R, G and B
+# channels, so uint8 images need one table lookup per channel instead of the
+# gamma expansion
+_uint8_luminance_luts = [weight * _gamma_expand(np.arange(256) / 255)
+                         for weight in _luminance_weights]
+
+
+def _linear_luminance(images: np.ndarray, compute_dtype: type) -> np.ndarray:
+    """
+    Calculates the linear luminance of ``images`` shaped as (N, H, W, 3).
+
+    :return: the linear luminance as ``np.ndarray`` of ``compute_dtype`` data
+        type shaped as (N, H, W).
+    """
+    if images.dtype == np.uint8:
+        luts = [lut.astype(compute_dtype) for lut in _uint8_luminance_luts]
+        y_linear = luts[0][images[..., 0]]
+        y_linear += luts[1][images[..., 1]]
+        y_linear += luts[2][images[..., 2]]
+        return y_linear
+
+    # we assume images have values in [0, 255] and normalize them to [0, 1]
+    # one channel at a time to keep the temporary arrays small
+    y_linear = np.zeros(images.shape[:-1], dtype=compute_dtype)
+    for channel, weight in enumerate(_luminance_weights):
+        rgb_norm = np.divide(images[..., channel], 255, dtype=compute_dtype)
+        y_linear += weight * _gamma_expand(rgb_norm)
+    return y_linear
+
+
+def _gamma_compress(y_linear: np.ndarray) -> np.ndarray:
+    """
+    Gets linear luminance back to a non-linear representation by the inverse
+    of the gamma expansion and denormalizes it to [0, 255]. ``y_linear`` is
+    overwritten with the result.
+    """
+    # only the few darkest pixels take the linear branch, so it is computed
+    # for them alone instead of evaluating both branches everywhere
+    linear_part = y_linear <= 0.0031308
+    y_linear_part = y_linear[linear_part] * (12.92 * 255)
+    y = np.power(y_linear, 1 / 2.4, out=y_linear)
+    y *= 1.055 * 255
+    y -= 0.055 * 255
+    y[linear_part] = y_linear_part
+    return y
+
+
+def to_grayscale_batch(images: np.ndarray, compute_dtype: type = np.float64) -> np.ndarray:
+    """
+    Converts a stack of images to grayscale using the colorimetric conversion.
+
+    :param images: the raw data of N images of the same size loaded with
+        Pillow (PIL), shaped as (N, H, W, 3) or, if they are grayscale
+        already, as (N, H, W).
+    :param compute_dtype: optional floating point data type the conversion is
+        computed in. ``np.float32`` needs half the memory and is faster, but
+        integer results may then differ by 1 from the ``np.float64`` ones
+        (the default) in rare rounding cases.
+    :return: grayscaled images as ``np.ndarray`` shaped as (N, 1, H, W) with
+        the data type of ``images``.
+    """
+    if images.ndim == 3:
+        return images.reshape((images.shape[0], 1, images.shape[1], images.shape[2]))
+    if images.ndim != 4:
+        raise ValueError('Images do not have a (N, H, W) or (N, H, W, 3) shape')
+    if images.shape[3] != 3:
+        raise ValueError('Images\' 4th dimension does not have a size 3')
+
+    grayscale = _gamma_compress(_linear_luminance(images, compute_dtype))
+
+    if np.issubdtype(images.dtype, np.integer):
+        grayscale = np.rint(grayscale, out=grayscale)
+    grayscale = grayscale.astype(images.dtype)
+    return grayscale.reshape((images.shape[0], 1, images.shape[1], images.shape[2]))
+
+
+def to_grayscale(pil_image: np.ndarray, compute_dtype: type = np.float64) -> np.ndarray:
     """
     Converts ``pil_image`` to grayscale using the colorimetric conversion.
 
     :param pil_image: the raw data of an image loaded with Pillow (PIL)
+    :param compute_dtype: optional floating point data type the conversion is
+        computed in (see ``to_grayscale_batch``).
     :return: grayscaled image as ``np.ndarray`` shaped as (1, H, W), where W is
         the width and H is the height of the image.
     """
@@ -16,32 +103,4 @@ def to_grayscale(pil_image: np.ndarray) -> np.ndarray:
     if pil_image.shape[2] != 3:
         raise ValueError('Image\'s 3rd dimension does not have a size 3')
 
-    # we assume pil_image has values in [0, 255] and normalize them to [0, 1]
-    rgb_norm = pil_image / 255
-
-    # apply gamma expansion
-    rgb_linear = np.where(rgb_norm <= 0.04045,
-                          rgb_norm / 12.92,
-                          ((rgb_norm + 0.055) / 1.055)**2.4)
-
-    # leave linear R, G and B channels separate in (H, W, 1) shaped ndarrays
-    r_linear = np.delete(rgb_linear, [1, 2], axis=2)
-    g_linear = np.delete(rgb_linear, [0, 2], axis=2)
-    b_linear = np.delete(rgb_linear, [0, 1], axis=2)
-    
-    # calculate linear luminance
-    y_linear = 0.2126 * r_linear + 0.7152 * g_linear + 0.0722 * b_linear
-
-    # get linear luminance back to a non-linear representation
-    # by the inverse of the gamma expansion
-    y = np.where(y_linear <= 0.0031308,
-                 12.92 * y_linear,
-                 1.055 * (y_linear ** (1/2.4)) - 0.055)
-
-    # shape luminance to (1, H, W) and denormalize it
-    grayscale = y.reshape((1, y.shape[0], y.shape[1])) * 255
-    
-    if np.issubdtype(pil_image.dtype, np.integer):
-        return grayscale.round(0).astype(pil_image.dtype)
-    return grayscale.astype(pil_image.dtype)
-
+    return to_grayscale_batch(pil_image[np.newaxis], compute_dtype)[0]
@@ -1,25 +1,7 @@
 import math
 import numpy as np
 
-
-def _pad_image(image: np.ndarray, pad_widths: tuple[int, int], axis: str) -> np.ndarray:
-    if axis == 'x':
-        axis_pad = ((0, 0), (0, 0), pad_widths)
-    elif axis == 'y':
-        axis_pad = ((0, 0), pad_widths, (0, 0))
-    else:
-        raise ValueError('axis should be either x or y')
-
-    return np.pad(image.copy(), axis_pad, mode='edge')
-
-
-def _crop_image(image: np.ndarray, crop_widths: tuple[int, int], axis: str) -> np.ndarray:
-    if axis == 'x':
-        return image[:, :, crop_widths[0]:-crop_widths[1]]
-    elif axis == 'y':
-        return image[:, crop_widths[0]:-crop_widths[1], :]
-    else:
-        raise ValueError('axis should be either x or y')
+from typing import Optional
 
 
 def _calc_pad_widths(init_length: int, dist_length: int) -> tuple[int, int]:
@@ -40,26 +22,53 @@ def _calc_crop_widths(init_length: int, dist_length: int) -> tuple[int, int]:
     )
 
 
-def _resize_image(image: np.ndarray, width: int, height: int) -> np.ndarray:
-    res_image = image.copy()
-    image_width = image.shape[2]
-    image_height = image.shape[1]
+def _calc_window(init_length: int, dist_length: int) -> tuple[slice, int]:
+    """
+    Calculates how a dimension of ``init_length`` is resized to
+    ``dist_length``.
+
+    :return: a tuple of the slice of the dimension that is kept (all of it if
+        the dimension is padded) and the number of pixels padded before it.
+    """
+    if dist_length < init_length:
+        crop_start = _calc_crop_widths(init_length, dist_length)[0]
+        return slice(crop_start, crop_start + dist_length), 0
+    return slice(0, init_length), _calc_pad_widths(init_length, dist_length)[0]
+
+
+def _pad_into(window: np.ndarray, out: np.ndarray, top: int, left: int) -> None:
+    """
+    Writes ``window`` into ``out`` at (``top``, ``left``) and fills the rest of
+    ``out`` with the nearest edge values of ``window``, which gives the same
+    result as ``np.pad`` with ``mode='edge'`` without allocating any array.
+    """
+    window_height, window_width = window.shape[1], window.shape[2]
+    bottom, right = top + window_height, left + window_width
+
+    # every part is filled from window, as NumPy copies a source that
+    # overlaps the destination (e.g. an edge column of out) into a temporary
+    for rows, edge_rows in ((slice(0, top), slice(0, 1)), (slice(top, bottom), slice(None)),
+                            (slice(bottom, None), slice(-1, None))):
+        out[:, rows, left:right] = window[:, edge_rows, :]
+        # the corners get the values of the window's corners
+        out[:, rows, :left] = window[:, edge_rows, :1]
+        out[:, rows, right:] = window[:, edge_rows, -1:]
+
 
-    if width > image_width:
-        pad_widths = _calc_pad_widths(image_width, width)
-        res_image = _pad_image(res_image, pad_widths, axis='x')
-    elif width < image_width:
-        crop_widths = _calc_crop_widths(image_width, width)
-        res_image = _crop_image(res_image, crop_widths, axis='x')
+def _resize_image(image: np.ndarray, width: int, height: int,
+                  out: Optional[np.ndarray] = None, copy: bool = True) -> np.ndarray:
+    x_window, left = _calc_window(image.shape[2], width)
+    y_window, top = _calc_window(image.shape[1], height)
+    # cropping is only slicing, so window is a view of image
+    window = image[:, y_window, x_window]
 
-    if height > image_height:
-        pad_widths = _calc_pad_widths(image_height, height)
-        res_image = _pad_image(res_image, pad_widths, axis='y')
-    elif height < image_height:
-        crop_widths = _calc_crop_widths(image_height, height)
-        res_image = _crop_image(res_image, crop_widths, axis='y')
+    if out is None:
+        if not copy and window.shape[1] == height and window.shape[2] == width:
+            return window
+        out = np.empty((image.shape[0], height, width), dtype=image.dtype)
 
-    return res_image
+    _pad_into(window, out, top, left)
+    return out
 
 
 def prepare_image(image: np.ndarray,
@@ -67,7 +76,9 @@ def prepare_image(image: np.ndarray,
                   height: int,
                   x: int,
                   y: int,
-                  size: int) -> tuple[np.ndarray, np.ndarray]:
+                  size: int,
+                  out: Optional[np.ndarray] = None,
+                  copy: bool = True) -> tuple[np.ndarray, np.ndarray]:
     """
     Prepares the given image, represented as 3D NumPy ``ndarray``,
     for classification tasks by padding and/or cropping it to the desired
@@ -84,16 +95,25 @@ def prepare_image(image: np.ndarray,
     :param y: the y-coordinate within the resized image where the subarea
         should start.
     :param size: the size in both dimensions of the cropped subarea.
+    :param out: optional preallocated ``ndarray`` of (1, ``height``, ``width``)
+        shape and ``image``'s data type the resized image is written to, e.g.
+        a buffer reused for every sample of a data loader, so that no memory
+        is allocated per call.
+    :param copy: optional flag. If ``False`` and ``out`` is not given, an
+        image that only has to be cropped is returned as a view of ``image``
+        instead of a copy.
     :raises ValueError:
         - if ``image`` does not have exactly 3 dimensions;
         - if ``image``'s channel size is not exactly 1;
         - if ``width``, ``height`` or ``size`` are less than 32;
         - if ``x`` or ``y`` are negative;
-        - if the subarea exceeds the resized image's width and height.
+        - if the subarea exceeds the resized image's width and height;
+        - if ``out`` does not have the shape and data type of the result.
     :return: a tuple of:
         1.) a 3D NumPy ``ndarray`` of (1, ``height``, ``width``) shape that
-            represents the resized copied version of ``image``. It has the same
-            data type as ``image``.
+            represents the resized copied version of ``image`` (``out`` if
+            given, a view of ``image`` if ``copy`` is ``False`` and ``image``
+            is only cropped). It has the same data type as ``image``.
         2.) a 3D NumPy ``ndarray`` of (1, ``size``, ``size``) shape that
             represents the subarea of ``image``. It has the same data type as
             ``image``.
@@ -111,7 +131,12 @@ def prepare_image(image: np.ndarray,
             'the subarea should not exceed the resized image width and height'
         )
 
-    resized_image = _resize_image(image, width, height)
+    if out is not None and (out.shape != (1, height, width) or out.dtype != image.dtype):
+        raise ValueError(
+            f'out should have shape {(1, height, width)} and dtype {image.dtype}'
+        )
+
+    resized_image = _resize_image(image, width, height, out, copy)
     subarea = resized_image[:, y:(y + size), x:(x + size)]
 
     return (resized_image, subarea)
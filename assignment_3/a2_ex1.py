@@ -1,29 +1,75 @@
 import numpy as np
+import profiling
 
 
-def to_grayscale(pil_image: np.ndarray) -> np.ndarray:
+_luminance_weights = (0.2126, 0.7152, 0.0722)
+
+
+def _gamma_expand(rgb: np.ndarray) -> np.ndarray:
+    return np.where(
+        rgb < 0.04045,
+        rgb / 12.92,
+        ((rgb + 0.055) / 1.055) ** 2.4
+    )
+
+
+# Linear luminance contribution of every uint8 value of the R, G and B channel,
+# so uint8 images need one table lookup per channel instead of the power
+_uint8_luminance_luts = [weight * _gamma_expand(np.arange(256) / 255) for weight in _luminance_weights]
+
+
+def _linear_luminance(images: np.ndarray, compute_dtype: type) -> np.ndarray:
+    if images.dtype == np.uint8:
+        luts = [lut.astype(compute_dtype) for lut in _uint8_luminance_luts]
+        grayscale_linear = luts[0][images[..., 0]]
+        grayscale_linear += luts[1][images[..., 1]]
+        grayscale_linear += luts[2][images[..., 2]]
+        return grayscale_linear
+
+    grayscale_linear = np.zeros(images.shape[:-1], dtype=compute_dtype)
+    for channel, weight in enumerate(_luminance_weights):
+        rgb = np.divide(images[..., channel], 255, dtype=compute_dtype)
+        grayscale_linear += weight * _gamma_expand(rgb)
+    return grayscale_linear
+
+
+def _gamma_compress(grayscale_linear: np.ndarray) -> np.ndarray:
+    # In place and scaled to [0, 255]; only the few dark pixels take the
+    # linear branch, so it is patched in afterwards instead of evaluating both
+    # branches everywhere with np.where
+    low = grayscale_linear < 0.0031308
+    grayscale_low = grayscale_linear[low] * (12.92 * 255)
+    grayscale = np.power(grayscale_linear, 1 / 2.4, out=grayscale_linear)
+    grayscale *= 1.055 * 255
+    grayscale -= 0.055 * 255
+    grayscale[low] = grayscale_low
+    return grayscale
+
+
+def to_grayscale_batch(images: np.ndarray, compute_dtype: type = np.float64) -> np.ndarray:
+    # Batched to_grayscale: (N, H, W) or (N, H, W, 3) -> (N, 1, H, W).
+    # compute_dtype=np.float32 halves the memory and is faster, but integer
+    # results may then differ by 1 from the float64 ones in rare rounding cases.
+    if images.ndim == 3:
+        return images.copy()[:, None]
+    if images.ndim != 4:
+        raise ValueError("images must have either shape (N, H, W) or (N, H, W, 3)")
+    if images.shape[3] != 3:
+        raise ValueError(f"images have shape (N, H, W, {images.shape[3]}), but they should have (N, H, W, 3)")
+
+    grayscale = _gamma_compress(_linear_luminance(images, compute_dtype))
+    if np.issubdtype(images.dtype, np.integer):
+        grayscale = np.rint(grayscale, out=grayscale)
+    return grayscale.astype(images.dtype)[:, None]    # (N, 1, H, W)
+
+
+@profiling.timed("to_grayscale")
+def to_grayscale(pil_image: np.ndarray, compute_dtype: type = np.float64) -> np.ndarray:
     if pil_image.ndim == 2:
         return pil_image.copy()[None]
     if pil_image.ndim != 3:
         raise ValueError("image must have either shape (H, W) or (H, W, 3)")
     if pil_image.shape[2] != 3:
         raise ValueError(f"image has shape (H, W, {pil_image.shape[2]}), but it should have (H, W, 3)")
-    
-    rgb = pil_image / 255
-    rgb_linear = np.where(
-        rgb < 0.04045,
-        rgb / 12.92,
-        ((rgb + 0.055) / 1.055) ** 2.4
-    )
-    grayscale_linear = 0.2126 * rgb_linear[..., 0] + 0.7152 * rgb_linear[..., 1] + 0.0722 * rgb_linear[..., 2]
-    
-    grayscale = np.where(
-        grayscale_linear < 0.0031308,
-        12.92 * grayscale_linear,
-        1.055 * grayscale_linear ** (1 / 2.4) - 0.055
-    )
-    grayscale = grayscale * 255
-    
-    if np.issubdtype(pil_image.dtype, np.integer):
-        grayscale = np.round(grayscale)
-    return grayscale.astype(pil_image.dtype)[None]    # (1, H, W)
+
+    return to_grayscale_batch(pil_image[None], compute_dtype)[0]    # (1, H, W)
@@ -1,45 +1,130 @@
 import numpy as np
-import math 
+import profiling
 
+from typing import Optional
+from numpy.lib.stride_tricks import sliding_window_view
 
-def prepare_image(image: np.ndarray, width: int, height: int, x: int, y: int, size: int) -> \
-        tuple[np.ndarray, np.ndarray]:
+
+def _window(length: int, target: int) -> tuple[slice, int]:
+    # Returns the kept part of a dimension and the number of pixels padded before it
+    if length > target:
+        # Crop center area
+        # if unequal crop one more at the end
+        start = (length - target) // 2
+        return slice(start, start + target), 0
+    return slice(0, length), (target - length) // 2
+
+
+def _pad_into(window: np.ndarray, out: np.ndarray, top: int, left: int) -> None:
+    # Same as np.pad(..., mode='edge'), but writes directly into out
+    bottom, right = top + window.shape[-2], left + window.shape[-1]
+    # Everything is filled from window: NumPy copies a source that overlaps
+    # the destination (e.g. an edge column of out) into a temporary first.
+    # Empty borders are skipped, as every assignment costs about a microsecond.
+    row_parts = [(slice(top, bottom), slice(None))]
+    if top > 0:
+        row_parts.append((slice(0, top), slice(0, 1)))
+    if bottom < out.shape[-2]:
+        row_parts.append((slice(bottom, None), slice(-1, None)))
+    for rows, edge_rows in row_parts:
+        out[..., rows, left:right] = window[..., edge_rows, :]
+        # Corners get the corner values of the window
+        if left > 0:
+            out[..., rows, :left] = window[..., edge_rows, :1]
+        if right < out.shape[-1]:
+            out[..., rows, right:] = window[..., edge_rows, -1:]
+
+
+def _resize_into(image: np.ndarray, out: np.ndarray) -> None:
+    # Center crop and/or edge pad image to the size of out
+    y_window, top = _window(image.shape[-2], out.shape[-2])
+    x_window, left = _window(image.shape[-1], out.shape[-1])
+    # Cropping is only slicing, so this is a view of image
+    _pad_into(image[..., y_window, x_window], out, top, left)
+
+
+def _check_sizes(width: int, height: int, size: int) -> None:
+    if width < 32 or height < 32 or size < 32:
+        raise ValueError("width/height/size must be >= 32")
+
+
+@profiling.timed("prepare_image")
+def prepare_image(image: np.ndarray, width: int, height: int, x: int, y: int, size: int,
+                  out: Optional[np.ndarray] = None, copy: bool = True) -> tuple[np.ndarray, np.ndarray]:
+    # out: optional preallocated (1, height, width) buffer of image's dtype the
+    #   result is written to, so repeated calls (e.g. in a data loader) allocate nothing
+    # copy=False: if out is not given and the image only has to be cropped,
+    #   the result is a view of image instead of a copy
     if image.ndim < 3 or image.shape[-3] != 1:
         # This is actually more general than the assignment specification
         raise ValueError("image must have shape (1, H, W)")
-    if width < 32 or height < 32 or size < 32:
-        raise ValueError("width/height/size must be >= 32")
+    _check_sizes(width, height, size)
     if x < 0 or (x + size) > width:
         raise ValueError(f"x={x} and size={size} do not fit into the resized image width={width}")
     if y < 0 or (y + size) > height:
         raise ValueError(f"y={y} and size={size} do not fit into the resized image height={height}")
-    
-
-    # Copy image
-    image = image.copy()
+    out_shape = image.shape[:-2] + (height, width)
+    if out is not None and (out.shape != out_shape or out.dtype != image.dtype):
+        raise ValueError(f"out must have shape {out_shape} and dtype {image.dtype}")
 
-    # Check if we need to pad or crop the image
-    if image.shape[1] > height:
-        # Crop center area
-        # if unequal crop one more at the start
-        image = image[:, (image.shape[1] - height) // 2: (image.shape[1] - height) // 2 + height, :]
-    else: 
-        # Pad with same value as the image
-        image = np.pad(image, ((0, 0), ((height - image.shape[1])//2, math.ceil((height - image.shape[1])/2)), (0, 0)), mode='edge')
-    
-    if image.shape[2] > width:
-        # Crop center area
-        image = image[:, :, (image.shape[2] - width) // 2: (image.shape[2] - width) // 2 + width]
+    if out is None and not copy and image.shape[-2] >= height and image.shape[-1] >= width:
+        # Cropping is only slicing, so this is a view of image
+        image = image[..., _window(image.shape[-2], height)[0], _window(image.shape[-1], width)[0]]
     else:
-        # Pad border in both directions with same value as the image
-        image = np.pad(image, ((0, 0), (0, 0), ((width - image.shape[2])//2, math.ceil((width - image.shape[2])/2))), mode='edge')
+        if out is None:
+            out = np.empty(out_shape, dtype=image.dtype)
+        # Pad with same value as the image
+        _resize_into(image, out)
+        image = out
 
     # Return subarea
-    subarea = image[:, y:y + size, x:x + size]
+    subarea = image[..., y:y + size, x:x + size]
+
+    return image, subarea
+
+
+def prepare_images(images, width: int, height: int, xs, ys, size: int) -> tuple[np.ndarray, np.ndarray]:
+    # Batched prepare_image: images is either an (N, 1, H, W) array or a list of
+    # N (1, H, W) arrays, xs and ys are scalars or arrays of N subarea offsets.
+    # Returns the (N, 1, height, width) resized images and the
+    # (N, 1, size, size) subareas. A stack is resized by one prepare_image
+    # call, list images are written into their slots of the result one by one,
+    # and the subareas are gathered from a sliding window view with one fancy
+    # index.
+    if isinstance(images, np.ndarray):
+        if images.ndim != 4 or images.shape[1] != 1:
+            raise ValueError("images must have shape (N, 1, H, W)")
+        n = images.shape[0]
+    else:
+        if len(images) == 0:
+            # an empty list has no dtype for the result, unlike an empty array
+            raise ValueError("images must not be an empty list")
+        if any(image.ndim != 3 or image.shape[0] != 1 for image in images):
+            raise ValueError("every image must have shape (1, H, W)")
+        if any(image.dtype != images[0].dtype for image in images):
+            raise ValueError("all images must have the same dtype")
+        n = len(images)
+    _check_sizes(width, height, size)
+    xs = np.broadcast_to(np.asarray(xs, dtype=np.intp), (n,))
+    ys = np.broadcast_to(np.asarray(ys, dtype=np.intp), (n,))
+    if np.any(xs < 0) or np.any(xs + size > width):
+        raise ValueError(f"xs and size={size} do not fit into the resized image width={width}")
+    if np.any(ys < 0) or np.any(ys + size > height):
+        raise ValueError(f"ys and size={size} do not fit into the resized image height={height}")
+
+    if isinstance(images, np.ndarray):
+        resized, _ = prepare_image(images, width, height, 0, 0, size)
+    else:
+        resized = np.empty((n, 1, height, width), dtype=images[0].dtype)
+        for index, image in enumerate(images):
+            # resized[index] is a view, so the image is written in place,
+            # without the per-call checks of prepare_image
+            _resize_into(image, resized[index])
 
-    
-    
-    return image, subarea  
+    windows = sliding_window_view(resized, (size, size), axis=(2, 3))
+    # Advanced indices separated by a slice move to the front: (N, 1, size, size)
+    subareas = windows[np.arange(n), :, ys, xs]
+    return resized, subareas
 
 
 # Reproduce example from the assignment
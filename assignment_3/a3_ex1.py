@@ -1,51 +1,190 @@
 import os
-import glob
+import zipfile
 import numpy as np
+import profiling
 
 from typing import Optional
 from torch.utils.data import Dataset
 from PIL import Image
 from a2_ex1 import to_grayscale
 from a2_ex2 import prepare_image
+from sample_cache import DiskSampleCache, LRUSampleCache
+
+
+def _list_dir(image_dir: str) -> tuple[list[str], Optional[str]]:
+	# names of the .jpg files (sorted) and the first .csv file in image_dir,
+	# without the per-file path handling of glob and os.path.abspath
+	image_names = []
+	csv_names = []
+	with os.scandir(image_dir) as entries:
+		for entry in entries:
+			# hidden files are skipped like glob does
+			if entry.name.startswith('.'):
+				continue
+			if entry.name.endswith('.jpg'):
+				image_names.append(entry.name)
+			elif entry.name.endswith('.csv'):
+				csv_names.append(entry.name)
+	image_names.sort()
+	return image_names, min(csv_names, default=None)
+
+
+def _read_labels(csv_file: str) -> dict[str, str]:
+	# maps the file names in the first column to the labels in the second one,
+	# skipping the column names
+	with open(csv_file) as f:
+		lines = f.read().splitlines()[1:]
+	labels = {}
+	for line in lines:
+		if line:
+			name, label = line.split(';', 1)
+			labels[name] = label
+	return labels
+
+
+def _build_manifest(image_dir: str) -> dict:
+	image_names, csv_name = _list_dir(image_dir)
+	if csv_name is None:
+		raise ValueError(f'no csv file found in {image_dir}')
+	labels = _read_labels(os.path.join(image_dir, csv_name))
+	missing = [name for name in image_names if name not in labels]
+	if missing:
+		raise ValueError(f'{len(missing)} images have no label in {csv_name}, e.g. {missing[0]}')
+
+	image_labels = [labels[name] for name in image_names]
+	class_names = sorted(set(image_labels))
+	class_ids = {class_name: class_id for class_id, class_name in enumerate(class_names)}
+	return {
+		'image_names': np.array(image_names),
+		'label_codes': np.array([class_ids[label] for label in image_labels], dtype=np.int32),
+		'class_names': np.array(class_names),
+		'csv_name': np.array(csv_name),
+	}
+
+
+def _manifest_key(image_dir: str, csv_name: str) -> str:
+	# adding, removing or renaming files changes the directory's mtime, editing
+	# the csv file its own mtime or size
+	dir_stat = os.stat(image_dir)
+	csv_stat = os.stat(os.path.join(image_dir, csv_name))
+	return f'{dir_stat.st_mtime_ns};{csv_stat.st_mtime_ns};{csv_stat.st_size}'
+
+
+def _load_manifest(image_dir: str, manifest_file: Optional[str]) -> dict:
+	if manifest_file is not None:
+		try:
+			with np.load(manifest_file) as manifest_npz:
+				manifest = dict(manifest_npz)
+			if str(manifest['key']) == _manifest_key(image_dir, str(manifest['csv_name'])):
+				return manifest
+		except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+			# missing, outdated or partially written manifest
+			pass
+
+	manifest = _build_manifest(image_dir)
+	if manifest_file is not None:
+		# creating the manifest file changes the mtime of the directory it is in,
+		# which may be image_dir, so the key is taken afterwards and the file is
+		# rewritten in place, which leaves the directory's mtime unchanged
+		with open(manifest_file, 'wb') as f:
+			np.savez(f, **manifest)
+		manifest['key'] = np.array(_manifest_key(image_dir, str(manifest['csv_name'])))
+		with open(manifest_file, 'wb') as f:
+			np.savez(f, **manifest)
+	return manifest
 
 
 class ImagesDataset(Dataset):
-	def __init__(self, image_dir, width: int = 100, height: int = 100, dtype: Optional[type] = None) -> None:
+	def __init__(self, image_dir, width: int = 100, height: int = 100, dtype: Optional[type] = None,
+				 cache: Optional[LRUSampleCache | DiskSampleCache] = None,
+				 manifest_file: Optional[str] = None, fast_decode: bool = False) -> None:
+		# The directory is listed and the labels are read on first use only.
+		# Labels are joined to the images by file name. manifest_file optionally
+		# caches the result in an .npz file, which is rebuilt when the directory
+		# or the csv file change.
+		#
+		# fast_decode lets the JPEG decoder output the luminance channel only and
+		# downscale by 1/2, 1/4 or 1/8 while decoding, as far as the image still
+		# covers width x height. This is not the exact path:
+		# - the decoder's luminance is the JPEG's Y channel (BT.601 weights on
+		#   gamma-encoded values) instead of to_grayscale's colorimetric
+		#   conversion. Both agree on grey pixels, but saturated colours can
+		#   differ by tens of grey levels (see benchmarks/bench_decode.py);
+		# - a downscaled image is cropped to width x height afterwards, so images
+		#   at least twice the target size show a larger, downscaled area.
 		super().__init__()
 		if width < 100 or height < 100:
 			raise ValueError('Width and height should be >= 100')
-		
-		self._image_paths = []
-		for image_path in glob.glob(f'{image_dir}/*.jpg'):
-			self._image_paths.append(os.path.abspath(image_path))
-		self._image_paths.sort()
-		
-		# take the first found csv file in the image dir
-		csv_file = glob.glob(f'{image_dir}/*.csv')[0]
-		
-		# convert csv file into np.ndarray skipping column names 
-		self._labels = np.genfromtxt(csv_file, delimiter=';', skip_header=1, dtype=str)
-		
-		# sort by class name in ascending order
-		self._labels.sort(axis=1)
+
+		self._image_dir = os.path.abspath(image_dir)
+		self._manifest_file = manifest_file
+		# sorted image file names, their class ids and the sorted class names as
+		# NumPy arrays, which keep the dataset's pickle small for DataLoader workers
+		self._image_names = None
+		self._label_codes = None
+		self._class_names = None
 
 		self._width = width
 		self._height = height
 		self._dtype = dtype
+		# optional cache of the preprocessed (1, H, W) arrays, see sample_cache
+		self._cache = cache
+		self._fast_decode = fast_decode
+
+	def _ensure_manifest(self) -> None:
+		if self._image_names is None:
+			manifest = _load_manifest(self._image_dir, self._manifest_file)
+			self._label_codes = manifest['label_codes']
+			self._class_names = manifest['class_names']
+			self._image_names = manifest['image_names']
 	
-	def __getitem__(self, index: int) -> tuple:
-		image_path = self._image_paths[index]
-		image = Image.open(image_path)
-		image_ndarray = np.asarray(image, dtype=self._dtype)
+	def _load_image(self, image_path: str) -> np.ndarray:
+		with profiling.stage('getitem.open'):
+			image = Image.open(image_path)
+		with image:
+			if profiling.is_enabled():
+				profiling.count('bytes_read', os.fstat(image.fp.fileno()).st_size, stage='getitem')
+			if self._fast_decode:
+				# only has an effect on JPEG files
+				image.draft('L', (self._width, self._height))
+			with profiling.stage('getitem.decode'):
+				image_ndarray = np.asarray(image, dtype=self._dtype)
 		image_ndarray = to_grayscale(image_ndarray)
 		image_ndarray, subarea = prepare_image(image_ndarray, self._width, self._height, 0, 0, 32)
+		return image_ndarray
+	
+	@profiling.timed('getitem')
+	def __getitem__(self, index: int) -> tuple:
+		self._ensure_manifest()
+		image_path = os.path.join(self._image_dir, self._image_names[index])
+		if self._cache is None:
+			image_ndarray = self._load_image(image_path)
+		else:
+			# a modified file gets a new key, so stale samples are never returned
+			key = (image_path, os.stat(image_path).st_mtime_ns, self._width, self._height, str(self._dtype),
+				   self._fast_decode)
+			image_ndarray = self._cache.get(key)
+			if image_ndarray is None:
+				profiling.count('cache_lookups', result='miss')
+				image_ndarray = self._load_image(image_path)
+				self._cache.put(key, image_ndarray)
+			else:
+				profiling.count('cache_lookups', result='hit')
 
-		class_name = self._labels[index][1]
+		class_name = str(self._class_names[self._label_codes[index]])
 
 		# class id corresponds to index
 		# (image, class_id, class_name, image_filepath)
 		return (image_ndarray, index, class_name, image_path)
 	
+	def sample_info(self, index: int) -> tuple:
+		# (class_id, class_name, image_filepath) of a sample, without loading
+		# its image (e.g. for SharedMemoryImagesDataset)
+		self._ensure_manifest()
+		return (index, str(self._class_names[self._label_codes[index]]),
+				os.path.join(self._image_dir, self._image_names[index]))
+
 	def __len__(self) -> int:
-		return len(self._image_paths)
+		self._ensure_manifest()
+		return len(self._image_names)
 
@@ -1,7 +1,12 @@
 import torch
+import threading
 import numpy as np
+import profiling
 
+from typing import Optional
 
+
+@profiling.timed("stacking")
 def stacking(batch_as_list: list) -> tuple:
 	stacked_images = torch.from_numpy(np.array([image for image, _, _, _ in batch_as_list]))
 	stacked_class_ids = torch.from_numpy(np.array([class_id for _, class_id, _, _ in batch_as_list]))	
@@ -11,3 +16,109 @@ def stacking(batch_as_list: list) -> tuple:
 	return stacked_images, stacked_class_ids, class_names, image_filepaths
 
 
+def _unzip_batch(batch_as_list: list) -> tuple:
+	# (images, class_ids, class_names, image_filepaths), in one pass over the batch
+	if not batch_as_list:
+		raise ValueError("batch is empty")
+	return tuple(zip(*batch_as_list))
+
+
+def _batch_error(images: tuple) -> ValueError:
+	# Only called after a failed copy: all images must share the shape and
+	# dtype of the first one, which is not checked per sample beforehand
+	shape, dtype = images[0].shape, images[0].dtype
+	for index, image in enumerate(images):
+		if image.shape != shape or image.dtype != dtype:
+			return ValueError(f"sample {index} of the batch has shape {image.shape} and dtype {image.dtype}, "
+							  f"but sample 0 has shape {shape} and dtype {dtype}")
+	return ValueError("the images of the batch cannot be stacked")
+
+
+_torch_dtypes = {}
+
+
+def _torch_dtype(dtype: np.dtype) -> torch.dtype:
+	torch_dtype = _torch_dtypes.get(dtype)
+	if torch_dtype is None:
+		torch_dtype = _torch_dtypes[dtype] = torch.from_numpy(np.empty(0, dtype=dtype)).dtype
+	return torch_dtype
+
+
+def _empty_images(n: int, shape: tuple, dtype: np.dtype, pin_memory: bool) -> torch.Tensor:
+	if not pin_memory:
+		# NumPy's allocator is several times cheaper than torch.empty for this
+		return torch.from_numpy(np.empty((n,) + shape, dtype=dtype))
+	# pin_memory needs an accelerator (e.g. CUDA), torch raises a RuntimeError otherwise
+	return torch.empty((n,) + shape, dtype=_torch_dtype(dtype), pin_memory=True)
+
+
+def _copy_images(images: tuple, out: np.ndarray) -> None:
+	# casting='no' makes images of another dtype fail instead of being cast
+	try:
+		if out.ndim > 1 and out.flags.c_contiguous:
+			# Concatenating the (C, H, W) images along C into an (N * C, H, W) view
+			# of out avoids the per-image expand_dims of np.stack. The reshape of a
+			# non-contiguous out (e.g. a slice) would be a copy instead of a view.
+			np.concatenate(images, axis=0, out=out.reshape((-1,) + out.shape[2:]), casting="no")
+		else:
+			np.stack(images, out=out, casting="no")
+	except (ValueError, TypeError) as e:
+		raise _batch_error(images) from e
+
+
+@profiling.timed("stacking")
+def stacking_into(batch_as_list: list, out: Optional[torch.Tensor] = None, pin_memory: bool = False) -> tuple:
+	# Like stacking, but every image is copied once, directly into its slot of
+	# out (or of a tensor allocated for the batch, in pinned memory if
+	# pin_memory is True, so it can be transferred with non_blocking=True).
+	# Without pinning, the copy is memory-bound and about as fast as stacking;
+	# the gain is that DataLoader(pin_memory=True) no longer copies the batch
+	# again into pinned memory.
+	images, class_ids, class_names, image_filepaths = _unzip_batch(batch_as_list)
+	shape, dtype = images[0].shape, images[0].dtype
+	if out is None:
+		out = _empty_images(len(images), shape, dtype, pin_memory)
+	elif tuple(out.shape) != (len(images),) + shape or out.dtype != _torch_dtype(dtype):
+		raise ValueError(f"out has shape {tuple(out.shape)} and dtype {out.dtype}, but the batch needs shape "
+						 f"{(len(images),) + shape} and the dtype of {dtype}")
+	return _stack_into(images, class_ids, class_names, image_filepaths, out)
+
+
+def _stack_into(images: tuple, class_ids: tuple, class_names: tuple, image_filepaths: tuple,
+				out: torch.Tensor) -> tuple:
+	_copy_images(images, out.numpy())
+	return out, torch.from_numpy(np.array(class_ids)), list(class_names), list(image_filepaths)
+
+
+class BufferedStacking:
+	# collate_fn that reuses a ring of num_buffers preallocated image tensors
+	# instead of allocating one per batch. A batch's images tensor is
+	# overwritten num_buffers batches later, so num_buffers must exceed the
+	# number of batches in use at once (e.g. the one being trained on and the
+	# one being transferred; with a PrefetchLoader also the prefetch_batches
+	# loaded ahead plus one per thread). Only useful in the process that
+	# collates, i.e. with DataLoader(num_workers=0) or a PrefetchLoader.
+	def __init__(self, num_buffers: int = 2, pin_memory: bool = False) -> None:
+		if num_buffers < 1:
+			raise ValueError("num_buffers must be >= 1")
+		self._buffers = [None] * num_buffers
+		self._next = 0
+		self._pin_memory = pin_memory
+		# collate_fn may be called by several PrefetchLoader threads at once
+		self._lock = threading.Lock()
+
+	@profiling.timed("stacking")
+	def __call__(self, batch_as_list: list) -> tuple:
+		images, class_ids, class_names, image_filepaths = _unzip_batch(batch_as_list)
+		shape, dtype = images[0].shape, images[0].dtype
+		with self._lock:
+			buffer = self._buffers[self._next]
+			if buffer is None or tuple(buffer.shape[1:]) != shape or len(buffer) < len(images) \
+					or buffer.dtype != _torch_dtype(dtype):
+				buffer = _empty_images(len(images), shape, dtype, self._pin_memory)
+				self._buffers[self._next] = buffer
+			self._next = (self._next + 1) % len(self._buffers)
+		if len(buffer) > len(images):
+			# The last batch of an epoch may be smaller, it uses the front of the buffer
+			buffer = buffer[:len(images)]
+		return _stack_into(images, class_ids, class_names, image_filepaths, buffer)
@@ -0,0 +1,80 @@
+import torch
+import numpy as np
+import profiling
+
+from numpy.lib.stride_tricks import sliding_window_view
+from a2_ex2 import prepare_images
+
+
+class RandomCrop:
+	# Random size x size crops (and optionally horizontal flips) of the
+	# width x height samples of a dataset, for use as a DataLoader collate_fn
+	# instead of stacking. The crop offsets and flips of all num_samples samples
+	# are drawn at once per epoch from a generator seeded with (seed, epoch), and
+	# looked up by the sample index (the class_id of ImagesDataset samples). So
+	# an epoch's crops only depend on seed and epoch, not on the batch order,
+	# batch size or number of workers.
+	#
+	# Call set_epoch before every epoch (before iterating the DataLoader, so
+	# that its worker processes get the new epoch with their copy of the
+	# collate_fn, unless persistent_workers is used).
+	def __init__(self, size: int, num_samples: int, width: int = 100, height: int = 100, seed: int = 0,
+				 flip: bool = False) -> None:
+		if width < 32 or height < 32:
+			# the minimum size of prepare_images, which resizes other images
+			raise ValueError("width/height must be >= 32")
+		if not 0 < size <= min(width, height):
+			raise ValueError(f"size must be in [1, {min(width, height)}]")
+		self.size = size
+		self.num_samples = num_samples
+		self.width = width
+		self.height = height
+		self.seed = seed
+		self.flip = flip
+		self.set_epoch(0)
+
+	def set_epoch(self, epoch: int) -> None:
+		self.epoch = epoch
+		rng = np.random.default_rng([self.seed, epoch])
+		self._xs = rng.integers(0, self.width - self.size + 1, self.num_samples)
+		self._ys = rng.integers(0, self.height - self.size + 1, self.num_samples)
+		self._flips = rng.random(self.num_samples) < 0.5 if self.flip else None
+
+	def params(self, indices) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+		# (xs, ys, flips) of the samples with the given indices in this epoch
+		indices = np.asarray(indices, dtype=np.intp)
+		flips = self._flips[indices] if self.flip else np.zeros(len(indices), dtype=bool)
+		return self._xs[indices], self._ys[indices], flips
+
+	def crop(self, images, indices) -> np.ndarray:
+		# images: (N, 1, H, W) array or list of N (1, H, W) arrays, resized to
+		# width x height by prepare_images unless they have that size already,
+		# as ImagesDataset samples do. The crops are gathered from a strided
+		# sliding window view of the images into one (N, 1, size, size) array,
+		# and the flipped ones are mirrored in place.
+		xs, ys, flips = self.params(indices)
+		# Only the resized images of prepare_images are used, so its subarea has
+		# its minimum size, which does not restrict self.size
+		try:
+			images = np.asarray(images)
+		except ValueError:
+			# images of different sizes
+			images = prepare_images(images, self.width, self.height, 0, 0, 32)[0]
+		if images.shape[1:] != (1, self.height, self.width):
+			images = prepare_images(images, self.width, self.height, 0, 0, 32)[0]
+		windows = sliding_window_view(images, (self.size, self.size), axis=(2, 3))
+		# Advanced indices separated by a slice move to the front: (N, 1, size, size)
+		crops = windows[np.arange(len(xs)), :, ys, xs]
+		if flips.any():
+			crops[flips] = crops[flips][..., ::-1]
+		return crops
+
+	@profiling.timed("stacking")
+	def __call__(self, batch_as_list: list) -> tuple:
+		# collate_fn: like stacking, with the cropped images
+		class_ids = np.array([class_id for _, class_id, _, _ in batch_as_list])
+		stacked_images = torch.from_numpy(self.crop([image for image, _, _, _ in batch_as_list], class_ids))
+		class_names = [class_name for _, _, class_name, _ in batch_as_list]
+		image_filepaths = [image_filepath for _, _, _, image_filepath in batch_as_list]
+
+		return stacked_images, torch.from_numpy(class_ids), class_names, image_filepaths
@@ -0,0 +1,83 @@
+import os
+import numpy as np
+
+from torch.utils.data import Dataset
+
+
+def compile_dataset(dataset: Dataset, output_prefix: str) -> None:
+	# Runs every sample of dataset (e.g. an ImagesDataset) through its
+	# preprocessing once and writes the resulting (1, H, W) arrays into one
+	# contiguous (N, 1, H, W) array in <output_prefix>.npy, along with the
+	# class names and image paths in <output_prefix>_index.npz.
+	if len(dataset) == 0:
+		raise ValueError('dataset is empty')
+	first_image = dataset[0][0]
+	images_file = f'{output_prefix}.npy'
+	index_file = f'{output_prefix}_index.npz'
+	os.makedirs(os.path.dirname(os.path.abspath(output_prefix)), exist_ok=True)
+
+	# written under temporary names first, so an interrupted compilation never
+	# leaves a truncated dataset behind
+	try:
+		images = np.lib.format.open_memmap(f'{images_file}.tmp', mode='w+', dtype=first_image.dtype,
+										   shape=(len(dataset),) + first_image.shape)
+		class_names = []
+		image_paths = []
+		for index in range(len(dataset)):
+			image, _, class_name, image_path = dataset[index]
+			if image.shape != first_image.shape or image.dtype != first_image.dtype:
+				raise ValueError(f'sample {index} has shape {image.shape} and dtype {image.dtype}, but sample 0 has '
+								 f'shape {first_image.shape} and dtype {first_image.dtype}')
+			images[index] = image
+			class_names.append(class_name)
+			image_paths.append(image_path)
+		images.flush()
+		images = None
+
+		with open(f'{index_file}.tmp', 'wb') as f:
+			np.savez(f, class_names=np.array(class_names), image_paths=np.array(image_paths))
+	except BaseException:
+		# the full-size images file would otherwise stay behind, e.g. after a
+		# sample of another shape or an interrupt. The map is released first.
+		images = None
+		for temp_file in (f'{images_file}.tmp', f'{index_file}.tmp'):
+			try:
+				os.remove(temp_file)
+			except FileNotFoundError:
+				pass
+		raise
+	os.replace(f'{images_file}.tmp', images_file)
+	os.replace(f'{index_file}.tmp', index_file)
+
+
+class MemmapImagesDataset(Dataset):
+	# Reads the samples written by compile_dataset with np.memmap slicing: no
+	# file is opened or decoded per sample, and the returned images are
+	# read-only views of the memory-mapped file. The file is only mapped on
+	# first access, so DataLoader workers get a small pickle and map the file
+	# themselves, sharing the page cache instead of decoding separately.
+	def __init__(self, prefix: str) -> None:
+		super().__init__()
+		self._images_file = f'{prefix}.npy'
+		with np.load(f'{prefix}_index.npz') as index:
+			self._class_names = index['class_names']
+			self._image_paths = index['image_paths']
+		self._images = None
+
+	@property
+	def images(self) -> np.ndarray:
+		if self._images is None:
+			self._images = np.load(self._images_file, mmap_mode='r')
+		return self._images
+
+	def __getstate__(self) -> dict:
+		state = self.__dict__.copy()
+		state['_images'] = None
+		return state
+
+	def __getitem__(self, index: int) -> tuple:
+		# (image, class_id, class_name, image_filepath) as in ImagesDataset
+		return (self.images[index], index, str(self._class_names[index]), str(self._image_paths[index]))
+
+	def __len__(self) -> int:
+		return len(self._image_paths)
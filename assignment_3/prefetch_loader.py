@@ -0,0 +1,73 @@
+import numpy as np
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator, Optional
+from torch.utils.data import Dataset
+from a3_ex2 import stacking
+
+
+class PrefetchLoader:
+	# Iterates over the batches of dataset like a DataLoader, but loads them on a
+	# pool of num_threads threads in the same process: PIL's decoding and most
+	# NumPy operations release the GIL, so the threads run in parallel for the
+	# bulk of the work, while sharing one copy of the dataset and its cache.
+	#
+	# Up to prefetch_batches batches (by default 2 * num_threads) are loaded
+	# ahead of the one being consumed, and they are delivered in order. Every
+	# batch is loaded and collated by one thread, so collate_fn must be thread-safe.
+	def __init__(self, dataset: Dataset, batch_size: int = 1, shuffle: bool = False, drop_last: bool = False,
+				 collate_fn: Callable[[list], tuple] = stacking, num_threads: int = 4,
+				 prefetch_batches: Optional[int] = None, seed: Optional[int] = None) -> None:
+		if batch_size < 1:
+			raise ValueError("batch_size must be >= 1")
+		if num_threads < 1:
+			raise ValueError("num_threads must be >= 1")
+		if prefetch_batches is None:
+			prefetch_batches = 2 * num_threads
+		if prefetch_batches < 1:
+			raise ValueError("prefetch_batches must be >= 1")
+		self.dataset = dataset
+		self.batch_size = batch_size
+		self.shuffle = shuffle
+		self.drop_last = drop_last
+		self.collate_fn = collate_fn
+		self.num_threads = num_threads
+		self.prefetch_batches = prefetch_batches
+		self._rng = np.random.default_rng(seed)
+		# also lets an ImagesDataset read its file list here, before the threads
+		# could all do it at once
+		self._num_samples = len(dataset)
+
+	def __len__(self) -> int:
+		if self.drop_last:
+			return self._num_samples // self.batch_size
+		return -(-self._num_samples // self.batch_size)
+
+	def _batch_indices(self) -> Iterator[np.ndarray]:
+		if self.shuffle:
+			indices = self._rng.permutation(self._num_samples)
+		else:
+			indices = np.arange(self._num_samples)
+		for start in range(0, len(self) * self.batch_size, self.batch_size):
+			yield indices[start:start + self.batch_size]
+
+	def _load_batch(self, indices: np.ndarray) -> tuple:
+		return self.collate_fn([self.dataset[int(index)] for index in indices])
+
+	def __iter__(self) -> Iterator[tuple]:
+		batch_indices = self._batch_indices()
+		with ThreadPoolExecutor(self.num_threads) as executor:
+			futures = deque()
+			try:
+				for indices in batch_indices:
+					futures.append(executor.submit(self._load_batch, indices))
+					if len(futures) > self.prefetch_batches:
+						yield futures.popleft().result()
+				while futures:
+					yield futures.popleft().result()
+			finally:
+				# the consumer stopped early (or a batch failed): batches that have
+				# not started yet are dropped instead of being loaded for nothing
+				for future in futures:
+					future.cancel()
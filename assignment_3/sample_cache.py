@@ -0,0 +1,167 @@
+import os
+import hashlib
+import threading
+import numpy as np
+
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+
+class LRUSampleCache:
+	# In-process cache of preprocessed samples that evicts the least recently
+	# used ones once the arrays take more than max_bytes. Cached arrays are
+	# made read-only, as they are handed out to every caller without a copy.
+	def __init__(self, max_bytes: int) -> None:
+		if max_bytes < 0:
+			raise ValueError('max_bytes should be >= 0')
+		self.max_bytes = max_bytes
+		self.nbytes = 0
+		self.hits = 0
+		self.misses = 0
+		self._entries = OrderedDict()
+		self._lock = threading.Lock()
+
+	def get(self, key: Hashable) -> Optional[np.ndarray]:
+		with self._lock:
+			array = self._entries.get(key)
+			if array is None:
+				self.misses += 1
+				return None
+			self._entries.move_to_end(key)
+			self.hits += 1
+			return array
+
+	def put(self, key: Hashable, array: np.ndarray) -> None:
+		if array.nbytes > self.max_bytes:
+			return
+		array.flags.writeable = False
+		with self._lock:
+			previous = self._entries.pop(key, None)
+			if previous is not None:
+				self.nbytes -= previous.nbytes
+			self._entries[key] = array
+			self.nbytes += array.nbytes
+			while self.nbytes > self.max_bytes:
+				_, evicted = self._entries.popitem(last=False)
+				self.nbytes -= evicted.nbytes
+
+	def __len__(self) -> int:
+		return len(self._entries)
+
+	def __getstate__(self) -> dict:
+		# locks cannot be pickled (e.g. when a DataLoader starts its workers)
+		state = self.__dict__.copy()
+		del state['_lock']
+		return state
+
+	def __setstate__(self, state: dict) -> None:
+		self.__dict__.update(state)
+		self._lock = threading.Lock()
+
+	def stats(self) -> dict:
+		# Counts of this process only: DataLoader workers use their own copies
+		# of the cache, so their hits and misses do not show up in the main process
+		return {'hits': self.hits, 'misses': self.misses, 'entries': len(self), 'bytes': self.nbytes}
+
+
+class DiskSampleCache:
+	# On-disk cache of preprocessed samples as .npy files in cache_dir, which
+	# can be shared by several processes (e.g. DataLoader workers or later
+	# runs). An optional LRUSampleCache is used as the first tier in front of it.
+	#
+	# Once the files take more than max_bytes, the oldest written ones are
+	# removed, e.g. the entries of modified images, which get new keys. Every
+	# process adds its own writes to the size of cache_dir it last listed and
+	# only lists and evicts again once that exceeds max_bytes, so with several
+	# writers cache_dir can briefly exceed max_bytes by their pending writes.
+	def __init__(self, cache_dir: str, max_bytes: int, memory: Optional[LRUSampleCache] = None) -> None:
+		if max_bytes < 0:
+			raise ValueError('max_bytes should be >= 0')
+		os.makedirs(cache_dir, exist_ok=True)
+		self.cache_dir = cache_dir
+		self.max_bytes = max_bytes
+		self.memory = memory
+		self.hits = 0
+		self.misses = 0
+		# size of the entries in cache_dir, listed on the first put
+		self._nbytes = None
+		self._lock = threading.Lock()
+
+	def _file(self, key: Hashable) -> str:
+		return os.path.join(self.cache_dir, hashlib.blake2b(repr(key).encode(), digest_size=16).hexdigest() + '.npy')
+
+	def get(self, key: Hashable) -> Optional[np.ndarray]:
+		if self.memory is not None:
+			array = self.memory.get(key)
+			if array is not None:
+				return array
+		try:
+			array = np.load(self._file(key))
+		except (FileNotFoundError, ValueError, EOFError):
+			# missing or (from a crashed writer) unreadable entry
+			self.misses += 1
+			return None
+		self.hits += 1
+		if self.memory is not None:
+			self.memory.put(key, array)
+		return array
+
+	def put(self, key: Hashable, array: np.ndarray) -> None:
+		file = self._file(key)
+		# write to a temporary file first, so that concurrent readers never see
+		# a partially written entry
+		temp_file = f'{file}.{os.getpid()}.{threading.get_ident()}.tmp'
+		with open(temp_file, 'wb') as f:
+			np.save(f, array)
+			file_size = f.tell()
+		os.replace(temp_file, file)
+		with self._lock:
+			if self._nbytes is None:
+				self._nbytes = self._evict()
+			else:
+				self._nbytes += file_size
+				if self._nbytes > self.max_bytes:
+					self._nbytes = self._evict()
+		if self.memory is not None:
+			self.memory.put(key, array)
+
+	def _evict(self) -> int:
+		# Removes the oldest entries until the rest fit into max_bytes and
+		# returns their size. Other processes may remove entries meanwhile.
+		entries = []
+		with os.scandir(self.cache_dir) as dir_entries:
+			for entry in dir_entries:
+				if entry.name.endswith('.npy'):
+					try:
+						stat = entry.stat()
+					except FileNotFoundError:
+						continue
+					entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+		entries.sort()
+		nbytes = sum(size for _, size, _ in entries)
+		for _, size, path in entries:
+			if nbytes <= self.max_bytes:
+				break
+			try:
+				os.remove(path)
+			except FileNotFoundError:
+				pass
+			nbytes -= size
+		return nbytes
+
+	def __getstate__(self) -> dict:
+		# locks cannot be pickled (e.g. when a DataLoader starts its workers)
+		state = self.__dict__.copy()
+		del state['_lock']
+		return state
+
+	def __setstate__(self, state: dict) -> None:
+		self.__dict__.update(state)
+		self._lock = threading.Lock()
+
+	def stats(self) -> dict:
+		# Counts of this process only, see LRUSampleCache.stats
+		stats = {'hits': self.hits, 'misses': self.misses}
+		if self.memory is not None:
+			stats['memory'] = self.memory.stats()
+		return stats
@@ -0,0 +1,102 @@
+import io
+import os
+import glob
+import numpy as np
+import profiling
+
+from typing import BinaryIO, Iterator, Optional
+from torch.utils.data import IterableDataset, get_worker_info
+from PIL import Image
+from a2_ex1 import to_grayscale
+from a2_ex2 import prepare_image
+
+
+_block_size = 512
+
+
+def _shard_members(f: BinaryIO) -> Iterator[tuple[str, bytes]]:
+	# Minimal sequential reader for the tar shards of validate_images (regular
+	# USTAR members only), which yields the names and data of the members. It
+	# takes a fraction of the per-member time of tarfile's stream mode.
+	while True:
+		header = f.read(_block_size)
+		if len(header) < _block_size or header == bytes(_block_size):
+			# end of the archive
+			return
+		if header[257:262] != b'ustar' or header[156:157] not in (b'0', b'\0'):
+			raise ValueError(f'{f.name} is not a shard written by validate_images')
+		name = header[:100].rstrip(b'\0').decode()
+		size = int(header[124:136].rstrip(b'\0 ') or b'0', 8)
+		data = f.read(size)
+		if len(data) < size:
+			raise ValueError(f'{f.name} is truncated')
+		# the data is padded to whole blocks
+		f.seek(-size % _block_size, os.SEEK_CUR)
+		yield name, data
+
+
+class ShardedImagesDataset(IterableDataset):
+	# Streams the samples of the tar shards written by validate_images(...,
+	# shard_size=n) of assignment 1: every shard is read front to back through
+	# a read_size buffer, i.e. with a few large reads instead of opening one
+	# file per image. Samples are preprocessed like in ImagesDataset and come
+	# in the order of the shards; DataLoader workers each stream every
+	# num_workers-th shard.
+	def __init__(self, shard_dir: str, width: int = 100, height: int = 100, dtype: Optional[type] = None,
+				 read_size: int = 16 * 2 ** 20) -> None:
+		super().__init__()
+		if width < 100 or height < 100:
+			raise ValueError('Width and height should be >= 100')
+		self._shard_dir = os.path.abspath(shard_dir)
+		self._shard_files = sorted(glob.glob(os.path.join(glob.escape(self._shard_dir), 'shard-*.tar')))
+		if not self._shard_files:
+			raise ValueError(f'no shards found in {shard_dir}')
+		self._width = width
+		self._height = height
+		self._dtype = dtype
+		self._read_size = read_size
+
+		# the index of the first sample of every shard, counted from shards.csv
+		# (one sequential read), so that samples keep their index in any worker
+		samples_per_shard = dict.fromkeys((os.path.basename(file) for file in self._shard_files), 0)
+		with open(os.path.join(self._shard_dir, 'shards.csv')) as f:
+			next(f)
+			for line in f:
+				samples_per_shard[line.split(';', 2)[1]] += 1
+		self._shard_starts = np.cumsum([0] + list(samples_per_shard.values()))
+
+	def _load_image(self, data: bytes) -> np.ndarray:
+		with Image.open(io.BytesIO(data)) as image:
+			with profiling.stage('shards.decode'):
+				image_ndarray = np.asarray(image, dtype=self._dtype)
+		image_ndarray = to_grayscale(image_ndarray)
+		image_ndarray, subarea = prepare_image(image_ndarray, self._width, self._height, 0, 0, 32)
+		return image_ndarray
+
+	def _read_shard(self, shard_number: int) -> Iterator[tuple]:
+		shard_file = self._shard_files[shard_number]
+		index = int(self._shard_starts[shard_number])
+		image_name = image_data = None
+		with open(shard_file, 'rb', buffering=self._read_size) as f:
+			for member_name, data in _shard_members(f):
+				profiling.count('bytes_read', len(data), stage='shards')
+				if not member_name.endswith('.cls'):
+					image_name, image_data = member_name, data
+					continue
+				if image_name is None or os.path.splitext(image_name)[0] != os.path.splitext(member_name)[0]:
+					raise ValueError(f'{shard_file} has no image for the label {member_name}')
+				# (image, class_id, class_name, image_filepath) as in ImagesDataset
+				yield (self._load_image(image_data), index, data.decode(), f'{shard_file}/{image_name}')
+				image_name = image_data = None
+				index += 1
+
+	def __iter__(self) -> Iterator[tuple]:
+		worker_info = get_worker_info()
+		shard_numbers = range(len(self._shard_files))
+		if worker_info is not None:
+			shard_numbers = shard_numbers[worker_info.id::worker_info.num_workers]
+		for shard_number in shard_numbers:
+			yield from self._read_shard(shard_number)
+
+	def __len__(self) -> int:
+		return int(self._shard_starts[-1])
@@ -0,0 +1,161 @@
+import ctypes
+import weakref
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from torch.utils.data import Dataset
+
+
+_alignment = 64 # the images start at a cache line boundary of the slab
+_chunk_size = 64 # samples filled by a worker process at once
+
+
+# slabs that could not be closed yet, because arrays still use them
+_unclosed_slabs = []
+
+
+def _slab_buffer(shm: shared_memory.SharedMemory) -> ctypes.Array:
+	# NumPy does not keep a buffer export on shm.buf, so SharedMemory.close()
+	# would unmap the slab under arrays created from it directly. Arrays created
+	# from this buffer keep an export until they are deleted, during which
+	# close() raises BufferError instead.
+	return (ctypes.c_ubyte * shm.size).from_buffer(shm.buf)
+
+
+def _release(shm: shared_memory.SharedMemory, unlink: bool) -> None:
+	if unlink:
+		try:
+			shm.unlink()
+		except FileNotFoundError:
+			pass
+	_unclosed_slabs.append(shm)
+	for slab in list(_unclosed_slabs):
+		try:
+			slab.close()
+		except BufferError:
+			# arrays handed out still use it, another release tries again
+			continue
+		_unclosed_slabs.remove(slab)
+
+
+class SharedMemoryImagesDataset(Dataset):
+	# Keeps the preprocessed images of dataset (e.g. an ImagesDataset, whose
+	# samples all have the same shape and dtype) in one shared memory slab:
+	# a filled flag per sample, followed by the (N, 1, H, W) images. A sample is
+	# computed by the first process that needs it (or by fill) and then read by
+	# every process as a read-only view of the slab, so DataLoader workers
+	# share one copy instead of each caching their own. After fill(workers),
+	# which decodes on worker processes that write into the slab, the main
+	# process can read every epoch without workers, i.e. without pickling the
+	# batches between processes (DataLoader(num_workers=0) or PrefetchLoader).
+	#
+	# The process that creates the dataset owns the slab and unlinks it on
+	# close(), when the dataset is garbage collected or at exit. If the owner
+	# crashes, multiprocessing's resource tracker unlinks it. Pickled copies
+	# (e.g. in DataLoader workers) attach to the slab by name on first access
+	# and only close their mapping. The flag of a sample is set after its
+	# image is written, so a worker that dies while writing leaves a sample
+	# that is simply computed again.
+	def __init__(self, dataset: Dataset) -> None:
+		super().__init__()
+		self._dataset = dataset
+		self._num_samples = len(dataset)
+		if self._num_samples == 0:
+			raise ValueError('dataset is empty')
+		image = dataset[0][0]
+		self._shape = image.shape
+		self._dtype = image.dtype
+		self._images_offset = -(-self._num_samples // _alignment) * _alignment
+
+		shm = shared_memory.SharedMemory(create=True, size=self._images_offset + self._num_samples * image.nbytes)
+		self.name = shm.name
+		self._attach(shm, owner=True)
+		self._write(0, image)
+
+	def _attach(self, shm: shared_memory.SharedMemory, owner: bool) -> None:
+		self._shm = shm
+		self._finalizer = weakref.finalize(self, _release, shm, owner)
+		buffer = _slab_buffer(shm)
+		self._filled = np.ndarray((self._num_samples,), dtype=np.uint8, buffer=buffer)
+		self._images = np.ndarray((self._num_samples,) + self._shape, dtype=self._dtype, buffer=buffer,
+								  offset=self._images_offset)
+
+	def _ensure_attached(self) -> None:
+		if self._shm is None:
+			self._attach(shared_memory.SharedMemory(name=self.name), owner=False)
+
+	def __getstate__(self) -> dict:
+		# the slab is attached by name instead of being pickled
+		state = self.__dict__.copy()
+		for attribute in ('_shm', '_finalizer', '_filled', '_images'):
+			state[attribute] = None
+		return state
+
+	def _write(self, index: int, image: np.ndarray) -> None:
+		if image.shape != self._shape or image.dtype != self._dtype:
+			raise ValueError(f'sample {index} has shape {image.shape} and dtype {image.dtype}, but sample 0 has '
+							 f'shape {self._shape} and dtype {self._dtype}')
+		self._images[index] = image
+		self._filled[index] = 1
+
+	def _sample_info(self, index: int) -> tuple:
+		# (class_id, class_name, image_filepath) of the sample without decoding
+		# its image, if dataset supports it
+		if hasattr(self._dataset, 'sample_info'):
+			return self._dataset.sample_info(index)
+		return self._dataset[index][1:]
+
+	def __getitem__(self, index: int) -> tuple:
+		self._ensure_attached()
+		if not self._filled[index]:
+			image, *sample_info = self._dataset[index]
+			self._write(index, image)
+		else:
+			sample_info = self._sample_info(index)
+		image = self._images[index].view()
+		image.flags.writeable = False
+		return (image, *sample_info)
+
+	def __len__(self) -> int:
+		return self._num_samples
+
+	def _fill_chunk(self, indices: list[int]) -> None:
+		self._ensure_attached()
+		for index in indices:
+			if not self._filled[index]:
+				self._write(index, self._dataset[index][0])
+
+	def fill(self, workers: int = 1) -> None:
+		# Computes all samples that are not in the slab yet, on a pool of workers
+		# processes if workers > 1, which write into the slab directly. If a
+		# worker dies, the pool raises BrokenProcessPool; the samples written
+		# until then are kept, and fill can be called again.
+		self._ensure_attached()
+		indices = np.flatnonzero(self._filled == 0).tolist()
+		chunks = [indices[start:start + _chunk_size] for start in range(0, len(indices), _chunk_size)]
+		if workers == 1:
+			for chunk in chunks:
+				self._fill_chunk(chunk)
+			return
+		with ProcessPoolExecutor(max_workers=workers) as executor:
+			for _ in executor.map(self._fill_chunk, chunks):
+				pass
+
+	def filled(self) -> int:
+		self._ensure_attached()
+		return int(np.count_nonzero(self._filled))
+
+	def close(self) -> None:
+		# Unlinks the slab in the owner process. Images handed out before stay
+		# valid, the slab is unmapped once they are deleted.
+		self._filled = self._images = None
+		if self._finalizer is not None:
+			self._finalizer()
+		self._shm = None
+
+	def __enter__(self) -> 'SharedMemoryImagesDataset':
+		return self
+
+	def __exit__(self, *exc_info) -> None:
+		self.close()
@@ -0,0 +1,71 @@
+"""
+Compares the throughput of the collate functions of assignment_3/a3_ex2.py:
+``stacking`` (np.array copy plus torch.from_numpy), ``stacking_into`` (one
+copy into a tensor allocated per batch) and ``BufferedStacking`` (one copy into
+a reused buffer), optionally in pinned memory if CUDA is available, and the
+``RandomCrop`` collate function of assignment_3/augmentation.py.
+
+Usage: python bench_collate.py [--batch 64] [--size 100] [--batches 200] [--repeat 5]
+"""
+
+import argparse
+import os
+import sys
+import time
+from collections import deque
+
+import numpy as np
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'assignment_3'))
+from a3_ex2 import BufferedStacking, stacking, stacking_into
+from augmentation import RandomCrop
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--batch", type=int, default=64, help="Number of samples per batch. Default: 64")
+parser.add_argument("--size", type=int, default=100, help="Width and height of the samples. Default: 100")
+parser.add_argument("--batches", type=int, default=200, help="Number of collated batches per run. Default: 200")
+parser.add_argument("--repeat", type=int, default=5, help="Number of runs per variant, the best one is shown. Default: 5")
+args = parser.parse_args()
+
+rng = np.random.default_rng(0)
+# batches are cycled through, so the samples are not all in the CPU cache as
+# with a single repeated batch
+batches = [[(rng.integers(0, 256, (1, args.size, args.size), dtype=np.uint8), i, "class", f"{i}.jpg")
+            for i in range(args.batch)] for _ in range(8)]
+
+variants = {
+    "stacking": stacking,
+    "stacking_into": stacking_into,
+    # one buffer more than the two batches kept in use below
+    "BufferedStacking": BufferedStacking(num_buffers=3),
+}
+crop_size = args.size * 2 // 3
+if torch.cuda.is_available():
+    variants["stacking_into, pinned"] = lambda batch_as_list: stacking_into(batch_as_list, pin_memory=True)
+    variants["BufferedStacking, pinned"] = BufferedStacking(num_buffers=3, pin_memory=True)
+
+# the random crops are smaller and not compared with stacking
+variants[f"RandomCrop({crop_size})"] = RandomCrop(crop_size, args.batch, args.size, args.size)
+variants[f"RandomCrop({crop_size}, flip)"] = RandomCrop(crop_size, args.batch, args.size, args.size, flip=True)
+
+for name, collate in list(variants.items())[:-2]:
+    assert torch.equal(collate(batches[0])[0], stacking(batches[0])[0]), name
+
+# best of --repeat runs, interleaved so that all variants see the same load.
+# As in training, the last two batches stay referenced (one being trained on,
+# one being transferred), so a freed batch is not simply reused by the
+# allocator for the next one.
+best = {name: float("inf") for name in variants}
+for _ in range(args.repeat):
+    for name, collate in variants.items():
+        in_use = deque(maxlen=2)
+        start = time.perf_counter()
+        for i in range(args.batches):
+            in_use.append(collate(batches[i % len(batches)]))
+        best[name] = min(best[name], time.perf_counter() - start)
+
+nbytes = batches[0][0][0].nbytes * args.batch
+print(f"{'variant':>25} {'batches/s':>10} {'MB/s':>8}")
+for name, elapsed in best.items():
+    print(f"{name:>25} {args.batches / elapsed:>10.1f} {args.batches * nbytes / elapsed / 1e6:>8.1f}")
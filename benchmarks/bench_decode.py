@@ -0,0 +1,47 @@
+"""
+Compares the exact decode path of ``ImagesDataset.__getitem__`` with the
+``fast_decode`` one (JPEG draft mode: luminance only, reduced scale) on
+synthetic JPEG images of several resolutions. Reports the decode time per
+sample and how much the fast samples deviate from the exact ones.
+
+Usage: python bench_decode.py [--resolutions 100 200 400 800 1600] [--samples 50]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'assignment_3'))
+from a3_ex1 import ImagesDataset
+from corpus import write_corpus
+
+
+def _time_per_sample(dataset: ImagesDataset) -> float:
+    start = time.perf_counter()
+    for index in range(len(dataset)):
+        dataset[index]
+    return (time.perf_counter() - start) / len(dataset)
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--resolutions", type=int, nargs="+", default=[100, 200, 400, 800, 1600],
+                    help="Side lengths of the square test images. Default: 100 200 400 800 1600")
+parser.add_argument("--samples", type=int, default=50, help="Number of images per resolution. Default: 50")
+parser.add_argument("--target", type=int, default=100, help="Width and height of the samples. Default: 100")
+args = parser.parse_args()
+
+print(f"{'resolution':>10} {'exact [ms]':>11} {'fast [ms]':>10} {'speedup':>8} {'mean |diff|':>12} {'max |diff|':>11}")
+for side in args.resolutions:
+    with tempfile.TemporaryDirectory() as image_dir:
+        write_corpus(image_dir, args.samples, side)
+        exact = ImagesDataset(image_dir, args.target, args.target)
+        fast = ImagesDataset(image_dir, args.target, args.target, fast_decode=True)
+        exact_time = _time_per_sample(exact)
+        fast_time = _time_per_sample(fast)
+        diffs = np.stack([np.abs(exact[i][0].astype(np.int16) - fast[i][0]) for i in range(len(exact))])
+    print(f"{side:>10} {exact_time * 1e3:>11.2f} {fast_time * 1e3:>10.2f} {exact_time / fast_time:>7.1f}x "
+          f"{diffs.mean():>12.2f} {diffs.max():>11}")
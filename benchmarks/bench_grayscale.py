@@ -0,0 +1,65 @@
+"""
+Compares the previous per-image ``to_grayscale`` (float64 ``np.where`` on all
+channels) with the batched ``to_grayscale_batch`` engine of assignment_3 on
+stacks of synthetic uint8 RGB images. Reports the throughput in megapixels per
+second and the peak memory allocated by NumPy per megapixel (tracemalloc).
+
+Usage: python bench_grayscale.py [--batch 8] [--size 1000] [--repeat 3]
+"""
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'assignment_3'))
+from a2_ex1 import to_grayscale_batch
+
+
+def _reference_to_grayscale(pil_image: np.ndarray) -> np.ndarray:
+    # the implementation to_grayscale used before the batched engine
+    rgb = pil_image / 255
+    rgb_linear = np.where(rgb < 0.04045, rgb / 12.92, ((rgb + 0.055) / 1.055) ** 2.4)
+    grayscale_linear = 0.2126 * rgb_linear[..., 0] + 0.7152 * rgb_linear[..., 1] + 0.0722 * rgb_linear[..., 2]
+    grayscale = np.where(grayscale_linear < 0.0031308, 12.92 * grayscale_linear,
+                         1.055 * grayscale_linear ** (1 / 2.4) - 0.055)
+    return np.round(grayscale * 255).astype(pil_image.dtype)[None]
+
+
+def _measure(function, repeat: int) -> tuple[float, int]:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return min(times), peak
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--batch", type=int, default=8, help="Number of images per stack. Default: 8")
+parser.add_argument("--size", type=int, default=1000, help="Side length of the square images. Default: 1000")
+parser.add_argument("--repeat", type=int, default=3, help="Number of timed runs per case. Default: 3")
+args = parser.parse_args()
+
+images = np.random.default_rng(0).integers(0, 256, (args.batch, args.size, args.size, 3), dtype=np.uint8)
+megapixels = images[..., 0].size / 1e6
+expected = np.stack([_reference_to_grayscale(image) for image in images])
+
+cases = {
+    "reference, per image": lambda: [_reference_to_grayscale(image) for image in images],
+    "batch, float64": lambda: to_grayscale_batch(images),
+    "batch, float32": lambda: to_grayscale_batch(images, np.float32),
+}
+print(f"{'implementation':>22} {'MP/s':>8} {'peak MB/MP':>11} {'max diff':>9}")
+for name, function in cases.items():
+    elapsed, peak = _measure(function, args.repeat)
+    result = np.stack(function())
+    max_diff = np.abs(result.astype(np.int16) - expected).max()
+    print(f"{name:>22} {megapixels / elapsed:>8.1f} {peak / 1e6 / megapixels:>11.1f} {max_diff:>9}")
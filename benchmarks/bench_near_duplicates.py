@@ -0,0 +1,63 @@
+"""
+Measures the cost of a near-duplicate lookup in the multi-index hash table
+used by ``validate_images`` against the size of the corpus, compared to a linear scan
+over all hashes.
+
+Usage: python bench_near_duplicates.py [--sizes 1000 10000 100000]
+            [--threshold 6] [--queries 200]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'assignment_1'))
+from near_duplicates import NearDuplicateIndex, hamming_distance
+
+
+def _linear_find(hashes: list[int], hash_value: int, max_distance: int):
+    for other in hashes:
+        if hamming_distance(hash_value, other) <= max_distance:
+            return other
+    return None
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000],
+                    help="Numbers of hashes in the corpus. Default: 1000 10000 100000")
+parser.add_argument("--threshold", type=int, default=6, help="Maximum Hamming distance. Default: 6")
+parser.add_argument("--queries", type=int, default=200, help="Number of lookups per corpus size. Default: 200")
+args = parser.parse_args()
+
+rng = random.Random(0)
+print(f"{'corpus':>8} {'build [s]':>10} {'index [us]':>11} {'linear [us]':>12} {'speedup':>8}")
+for size in args.sizes:
+    hashes = [rng.getrandbits(64) for _ in range(size)]
+    start = time.perf_counter()
+    index = NearDuplicateIndex(args.threshold)
+    for hash_value in hashes:
+        index.add(hash_value)
+    build_time = time.perf_counter() - start
+
+    # half of the queries have a near duplicate in the corpus, half do not
+    queries = []
+    for i in range(args.queries):
+        hash_value = rng.getrandbits(64)
+        if i % 2 == 0:
+            hash_value = rng.choice(hashes)
+            for bit in rng.sample(range(64), args.threshold):
+                hash_value ^= 1 << bit
+        queries.append(hash_value)
+
+    start = time.perf_counter()
+    index_results = [index.find(query) is not None for query in queries]
+    index_time = (time.perf_counter() - start) / len(queries)
+    start = time.perf_counter()
+    linear_results = [_linear_find(hashes, query, args.threshold) is not None for query in queries]
+    linear_time = (time.perf_counter() - start) / len(queries)
+    assert index_results == linear_results
+
+    print(f"{size:>8} {build_time:>10.3f} {index_time * 1e6:>11.1f} {linear_time * 1e6:>12.1f} "
+          f"{linear_time / index_time:>7.1f}x")
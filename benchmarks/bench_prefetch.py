@@ -0,0 +1,99 @@
+"""
+Compares loading the batches of an ``ImagesDataset`` sequentially, with
+``PrefetchLoader`` threads and with DataLoader worker processes. Every variant
+runs in a fresh subprocess, in which the summed RSS of the process and its
+worker processes (if any) is sampled from /proc (Linux only). Pages shared
+between the processes count once per process, as in most memory accounting.
+
+Usage: python bench_prefetch.py [--images 512] [--side 400] [--batch 32] [--workers 4]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from torch.utils.data import DataLoader
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'assignment_3'))
+from a3_ex1 import ImagesDataset
+from a3_ex2 import stacking
+from corpus import write_corpus
+from prefetch_loader import PrefetchLoader
+
+
+def _rss_mb(pid: int) -> float:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def _tree_rss_mb() -> float:
+    pids = [os.getpid()]
+    for task in os.listdir("/proc/self/task"):
+        with open(f"/proc/self/task/{task}/children") as f:
+            pids += [int(pid) for pid in f.read().split()]
+    total = 0.0
+    for pid in pids:
+        try:
+            total += _rss_mb(pid)
+        except FileNotFoundError:
+            pass    # worker exited in the meantime
+    return total
+
+
+def _sample_peak_rss(peak: list, stop: threading.Event) -> None:
+    while not stop.wait(0.01):
+        peak[0] = max(peak[0], _tree_rss_mb())
+
+
+def _run_variant(variant: str, image_dir: str, batch: int, workers: int) -> dict:
+    dataset = ImagesDataset(image_dir)
+    if variant == "sequential":
+        loader = (stacking([dataset[index] for index in range(start, min(start + batch, len(dataset)))])
+                  for start in range(0, len(dataset), batch))
+    elif variant == "threads":
+        loader = PrefetchLoader(dataset, batch_size=batch, num_threads=workers)
+    else:
+        loader = DataLoader(dataset, batch_size=batch, num_workers=workers, collate_fn=stacking)
+    peak = [_tree_rss_mb()]
+    stop = threading.Event()
+    sampler = threading.Thread(target=_sample_peak_rss, args=(peak, stop))
+    sampler.start()
+    start = time.perf_counter()
+    samples = sum(len(images) for images, _, _, _ in loader)
+    elapsed = time.perf_counter() - start
+    stop.set()
+    sampler.join()
+    return {"samples_per_s": samples / elapsed, "peak_rss_mb": peak[0]}
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--images", type=int, default=512, help="Number of images. Default: 512")
+parser.add_argument("--side", type=int, default=400, help="Width and height of the images. Default: 400")
+parser.add_argument("--batch", type=int, default=32, help="Number of samples per batch. Default: 32")
+parser.add_argument("--workers", type=int, default=4, help="Number of threads or worker processes. Default: 4")
+parser.add_argument("--variant", choices=["sequential", "threads", "processes"], help=argparse.SUPPRESS)
+parser.add_argument("--image-dir", help=argparse.SUPPRESS)
+args = parser.parse_args()
+
+if args.variant is not None:
+    print(json.dumps(_run_variant(args.variant, args.image_dir, args.batch, args.workers)))
+    sys.exit()
+
+print(f"{os.cpu_count()} CPUs")
+print(f"{'variant':>12} {'samples/s':>10} {'peak RSS [MB]':>14}")
+with tempfile.TemporaryDirectory() as image_dir:
+    write_corpus(image_dir, args.images, args.side)
+    for variant in ["sequential", "threads", "processes"]:
+        output = subprocess.run([sys.executable, __file__, "--variant", variant, "--image-dir", image_dir,
+                                 "--batch", str(args.batch), "--workers", str(args.workers)],
+                                check=True, capture_output=True, text=True).stdout
+        result = json.loads(output.splitlines()[-1])
+        print(f"{variant:>12} {result['samples_per_s']:>10.1f} {result['peak_rss_mb']:>14.1f}")
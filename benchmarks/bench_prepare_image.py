@@ -0,0 +1,161 @@
+"""
+Compares the previous copying ``prepare_image`` versions of assignment_2 and
+assignment_3 with the current ones, with and without a reused ``out`` buffer,
+and reports the time and the peak memory allocated (tracemalloc) per call.
+Afterwards, compares a Python loop over ``prepare_image`` with the batched
+``prepare_images`` for (N, 1, H, W) stacks, lists of images with a few common
+resolutions and lists of images that all have different sizes.
+
+The repository has no test suite, so this script also serves as the check of
+these functions: it fails with an ``AssertionError`` if any variant differs
+from the previous implementation or the looped version, or if a call with
+``out=`` allocates more than the small array objects of its views.
+
+Usage: python bench_prepare_image.py [--calls 2000] [--size 100] [--batch 256]
+"""
+
+import argparse
+import importlib.util
+import math
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+benchmarks_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(benchmarks_dir, '..', 'assignment_3'))
+from a2_ex2 import prepare_image, prepare_images
+
+# assignment_2's module has the same name, so it is loaded from its path
+_spec = importlib.util.spec_from_file_location('assignment_2_a2_ex2',
+                                               os.path.join(benchmarks_dir, '..', 'assignment_2', 'a2_ex2.py'))
+assignment_2 = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(assignment_2)
+
+
+def _reference_prepare_image(image: np.ndarray, width: int, height: int, x: int, y: int, size: int):
+    # the implementation prepare_image used before writing into out buffers
+    image = image.copy()
+    if image.shape[1] > height:
+        image = image[:, (image.shape[1] - height) // 2: (image.shape[1] - height) // 2 + height, :]
+    else:
+        image = np.pad(image, ((0, 0), ((height - image.shape[1]) // 2, math.ceil((height - image.shape[1]) / 2)),
+                               (0, 0)), mode='edge')
+    if image.shape[2] > width:
+        image = image[:, :, (image.shape[2] - width) // 2: (image.shape[2] - width) // 2 + width]
+    else:
+        image = np.pad(image, ((0, 0), (0, 0), ((width - image.shape[2]) // 2, math.ceil((width - image.shape[2]) / 2))),
+                       mode='edge')
+    return image, image[:, y:y + size, x:x + size]
+
+
+def _reference_assignment_2_prepare_image(image: np.ndarray, width: int, height: int, x: int, y: int, size: int):
+    # the implementation assignment_2's prepare_image used before writing into
+    # out buffers: pads one pixel more at the end and crops one more at the
+    # beginning of a dimension. Cropping exactly one pixel returned an empty
+    # image ([1:-0]), which the current version fixes.
+    image = image.copy()
+    if width > image.shape[2]:
+        image = np.pad(image, ((0, 0), (0, 0), ((width - image.shape[2]) // 2, math.ceil((width - image.shape[2]) / 2))),
+                       mode='edge')
+    elif width < image.shape[2]:
+        image = image[:, :, math.ceil((image.shape[2] - width) / 2):-((image.shape[2] - width) // 2)]
+    if height > image.shape[1]:
+        image = np.pad(image, ((0, 0), ((height - image.shape[1]) // 2, math.ceil((height - image.shape[1]) / 2)),
+                               (0, 0)), mode='edge')
+    elif height < image.shape[1]:
+        image = image[:, math.ceil((image.shape[1] - height) / 2):-((image.shape[1] - height) // 2), :]
+    return image, image[:, y:y + size, x:x + size]
+
+
+def _measure(function, images: list) -> tuple[float, float]:
+    start = time.perf_counter()
+    for image in images:
+        function(image)
+    elapsed = (time.perf_counter() - start) / len(images)
+    # the peak above the memory in use before each call, i.e. what the call
+    # allocates at most, whether or not the result is kept afterwards
+    allocated = 0
+    tracemalloc.start()
+    for image in images:
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        function(image)
+        allocated += tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    return elapsed, allocated / len(images)
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--calls", type=int, default=2000, help="Number of images prepared per variant. Default: 2000")
+parser.add_argument("--size", type=int, default=100, help="Width and height of the prepared images. Default: 100")
+parser.add_argument("--batch", type=int, default=256, help="Number of images per batch. Default: 256")
+args = parser.parse_args()
+
+rng = np.random.default_rng(0)
+# a mix of images that have to be padded, cropped or both
+images = [rng.integers(0, 256, (1, rng.integers(args.size // 2, args.size * 2), rng.integers(args.size // 2, args.size * 2)),
+                       dtype=np.uint8) for _ in range(args.calls)]
+buffer = np.empty((1, args.size, args.size), dtype=np.uint8)
+kept = []
+
+variants = {
+    "reference": lambda image: kept.append(_reference_prepare_image(image, args.size, args.size, 0, 0, 32)[0]),
+    "new": lambda image: kept.append(prepare_image(image, args.size, args.size, 0, 0, 32)[0]),
+    "new, out=": lambda image: prepare_image(image, args.size, args.size, 0, 0, 32, out=buffer),
+    "a2 reference": lambda image: kept.append(
+        _reference_assignment_2_prepare_image(image, args.size, args.size, 0, 0, 32)[0]),
+    "a2 new": lambda image: kept.append(assignment_2.prepare_image(image, args.size, args.size, 0, 0, 32)[0]),
+    "a2 new, out=": lambda image: assignment_2.prepare_image(image, args.size, args.size, 0, 0, 32, out=buffer),
+}
+for image in images[:100]:
+    expected = _reference_prepare_image(image, args.size, args.size, 0, 0, 32)[0]
+    assert np.array_equal(prepare_image(image, args.size, args.size, 0, 0, 32)[0], expected)
+    assert np.array_equal(prepare_image(image, args.size, args.size, 0, 0, 32, out=buffer)[0], expected)
+    if args.size + 1 in image.shape[1:]:
+        # the previous assignment_2 result of a one-pixel crop was empty
+        continue
+    expected = _reference_assignment_2_prepare_image(image, args.size, args.size, 0, 0, 32)[0]
+    assert np.array_equal(assignment_2.prepare_image(image, args.size, args.size, 0, 0, 32)[0], expected)
+    assert np.array_equal(assignment_2.prepare_image(image, args.size, args.size, 0, 0, 32, out=buffer)[0], expected)
+
+# With out=, only the array objects of the views are allocated (about 1 kB),
+# no pixel data, which would be megabytes for images of this size
+large_images = [rng.integers(0, 256, shape, dtype=np.uint8) for shape in [(1, 1500, 800), (1, 800, 1500)]]
+large_buffer = np.empty((1, 1000, 1000), dtype=np.uint8)
+for module in (sys.modules['a2_ex2'], assignment_2):
+    _, allocated = _measure(lambda image: module.prepare_image(image, 1000, 1000, 0, 0, 32, out=large_buffer),
+                            large_images * 10)
+    assert allocated < 4096, f"{module.__file__}: prepare_image with out= allocates {allocated:.0f} bytes per call"
+
+print(f"{'variant':>12} {'us/call':>8} {'bytes allocated/call':>21}")
+for name, function in variants.items():
+    elapsed, allocated = _measure(function, images)
+    kept.clear()
+    print(f"{name:>12} {elapsed * 1e6:>8.1f} {allocated:>21.0f}")
+
+batch = [rng.integers(0, 256, (1, rng.integers(args.size // 2, args.size * 2), rng.integers(args.size // 2, args.size * 2)),
+                      dtype=np.uint8) for _ in range(args.batch)]
+resolutions = [(args.size * 3 // 4, args.size * 4 // 3), (args.size * 4 // 3, args.size * 3 // 4), (args.size * 2, args.size)]
+common = [rng.integers(0, 256, (1,) + resolutions[i % len(resolutions)], dtype=np.uint8) for i in range(args.batch)]
+stack = rng.integers(0, 256, (args.batch, 1, args.size * 2, args.size // 2), dtype=np.uint8)
+xs = rng.integers(0, args.size - 32 + 1, args.batch)
+ys = rng.integers(0, args.size - 32 + 1, args.batch)
+
+
+def _looped(images) -> tuple[np.ndarray, np.ndarray]:
+    results = [prepare_image(image, args.size, args.size, x, y, 32) for image, x, y in zip(images, xs, ys)]
+    return np.stack([resized for resized, _ in results]), np.stack([subarea for _, subarea in results])
+
+
+print(f"\n{'input':>14} {'loop [ms]':>10} {'batched [ms]':>13} {'speedup':>8}")
+for name, inputs in [("stack", stack), ("list, 3 sizes", common), ("list, N sizes", batch)]:
+    expected = _looped(inputs)
+    result = prepare_images(inputs, args.size, args.size, xs, ys, 32)
+    assert all(np.array_equal(e, r) for e, r in zip(expected, result))
+    loop_time = min(_measure(lambda _: _looped(inputs), [None] * 5)[0] for _ in range(3))
+    batched_time = min(_measure(lambda _: prepare_images(inputs, args.size, args.size, xs, ys, 32), [None] * 5)[0]
+                       for _ in range(3))
+    print(f"{name:>14} {loop_time * 1e3:>10.2f} {batched_time * 1e3:>13.2f} {loop_time / batched_time:>7.1f}x")
@@ -0,0 +1,74 @@
+"""
+Compares reading the output of ``validate_images`` as single files with
+``ImagesDataset`` and as tar shards (``shard_size``) with
+``ShardedImagesDataset``, once with only the decoding and preprocessing
+stripped away (raw reads) and once for the full samples. The page cache is
+not dropped, so on a cold or network filesystem the difference is larger.
+
+Usage: python bench_shards.py [--images 2000] [--side 128] [--shard-size 1000]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+benchmarks_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(benchmarks_dir, '..', 'assignment_1'))
+sys.path.insert(0, os.path.join(benchmarks_dir, '..', 'assignment_3'))
+from a1_ex2 import validate_images
+from a3_ex1 import ImagesDataset
+from corpus import write_corpus
+from shard_dataset import ShardedImagesDataset, _shard_members
+
+
+def _read_files(image_dir: str) -> int:
+    total = 0
+    for name in sorted(os.listdir(image_dir)):
+        if name.endswith(".jpg"):
+            with open(os.path.join(image_dir, name), "rb") as f:
+                total += len(f.read())
+    return total
+
+
+def _read_shards(shard_dir: str) -> int:
+    total = 0
+    for name in sorted(os.listdir(shard_dir)):
+        if name.endswith(".tar"):
+            with open(os.path.join(shard_dir, name), "rb", buffering=16 * 2 ** 20) as f:
+                for _, data in _shard_members(f):
+                    total += len(data)
+    return total
+
+
+def _timed(function, *args) -> float:
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--images", type=int, default=2000, help="Number of images. Default: 2000")
+parser.add_argument("--side", type=int, default=128, help="Width and height of the images. Default: 128")
+parser.add_argument("--shard-size", type=int, default=1000, help="Images per shard. Default: 1000")
+args = parser.parse_args()
+
+with tempfile.TemporaryDirectory() as work_dir:
+    input_dir, files_dir, shards_dir = (os.path.join(work_dir, name) for name in ("input", "files", "shards"))
+    os.mkdir(input_dir)
+    write_corpus(input_dir, args.images, args.side)
+    validate_images(input_dir, files_dir, os.path.join(work_dir, "files.log"))
+    validate_images(input_dir, shards_dir, os.path.join(work_dir, "shards.log"), shard_size=args.shard_size)
+
+    files_dataset = ImagesDataset(files_dir)
+    shards_dataset = ShardedImagesDataset(shards_dir)
+    timings = {
+        "raw reads": (_timed(_read_files, files_dir), _timed(_read_shards, shards_dir)),
+        "samples": (_timed(lambda: [files_dataset[i] for i in range(len(files_dataset))]),
+                    _timed(lambda: list(shards_dataset))),
+    }
+
+print(f"{'':>10} {'files [s]':>10} {'shards [s]':>11} {'speedup':>8}")
+for name, (files_time, shards_time) in timings.items():
+    print(f"{name:>10} {files_time:>10.3f} {shards_time:>11.3f} {files_time / shards_time:>7.1f}x")
@@ -0,0 +1,57 @@
+"""
+Compares several epochs over an ``ImagesDataset`` loaded by DataLoader worker
+processes with the same epochs over a ``SharedMemoryImagesDataset``, whose
+slab is filled once by worker processes and then read by the main process
+without workers. Reports the time of the first and of the later epochs.
+
+Usage: python bench_shared_memory.py [--images 512] [--side 400] [--workers 2] [--epochs 3]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from torch.utils.data import DataLoader
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'assignment_3'))
+from a3_ex1 import ImagesDataset
+from a3_ex2 import stacking
+from corpus import write_corpus
+from shared_memory_dataset import SharedMemoryImagesDataset
+
+
+def _epoch_times(loader, epochs: int, before_first=None) -> list[float]:
+    times = []
+    for epoch in range(epochs):
+        start = time.perf_counter()
+        if epoch == 0 and before_first is not None:
+            before_first()
+        for _ in loader:
+            pass
+        times.append(time.perf_counter() - start)
+    return times
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--images", type=int, default=512, help="Number of images. Default: 512")
+parser.add_argument("--side", type=int, default=400, help="Width and height of the images. Default: 400")
+parser.add_argument("--batch", type=int, default=32, help="Number of samples per batch. Default: 32")
+parser.add_argument("--workers", type=int, default=2, help="Number of worker processes. Default: 2")
+parser.add_argument("--epochs", type=int, default=3, help="Number of epochs. Default: 3")
+args = parser.parse_args()
+
+with tempfile.TemporaryDirectory() as image_dir:
+    write_corpus(image_dir, args.images, args.side)
+    dataset = ImagesDataset(image_dir)
+    workers_times = _epoch_times(DataLoader(dataset, batch_size=args.batch, num_workers=args.workers,
+                                            collate_fn=stacking), args.epochs)
+    with SharedMemoryImagesDataset(ImagesDataset(image_dir)) as shared:
+        shared_times = _epoch_times(DataLoader(shared, batch_size=args.batch, collate_fn=stacking), args.epochs,
+                                    lambda: shared.fill(args.workers))
+
+print(f"{'':>28} {'first epoch [s]':>16} {'later epochs [s]':>17}")
+for name, times in (("DataLoader workers", workers_times), ("shared memory slab", shared_times)):
+    print(f"{name:>28} {times[0]:>16.3f} {np.mean(times[1:]) if len(times) > 1 else float('nan'):>17.3f}")
@@ -0,0 +1,181 @@
+"""
+Benchmarks every stage from the raw images to a collated batch on synthetic
+JPEG corpora generated with fixed seeds, one corpus per combination of
+--images, --resolutions and --modes:
+
+- ``validate_images`` (assignment_1) on the whole corpus,
+- ``to_grayscale`` and ``prepare_image`` (assignment_3) per decoded image,
+- ``ImagesDataset.__getitem__`` per sample and ``stacking`` per batch,
+- the full pipeline: ``validate_images`` into a new directory, then loading
+  all batches of an ``ImagesDataset`` over it with ``stacking``.
+
+For every stage and corpus it reports the throughput in images/s, the p50,
+p90 and p99 latency of one call (per image, sample, batch or whole run) and
+the peak RSS while the stage ran (reset through /proc/self/clear_refs on
+Linux, otherwise the peak of the whole process so far). --output writes the results
+as JSON, which a later run compares itself against with --compare.
+
+Usage: python bench_suite.py [--images 100] [--resolutions 128 512 1024] [--modes RGB L]
+                             [--output baseline.json] [--compare baseline.json]
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+benchmarks_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(benchmarks_dir, '..', 'assignment_1'))
+sys.path.insert(0, os.path.join(benchmarks_dir, '..', 'assignment_3'))
+from a1_ex2 import validate_images
+from a2_ex1 import to_grayscale
+from a2_ex2 import prepare_image
+from a3_ex1 import ImagesDataset
+from a3_ex2 import stacking
+from corpus import write_corpus
+
+def _reset_peak_rss() -> None:
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def _peak_rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (2 ** 20 if sys.platform == "darwin" else 1024)
+
+
+def _run_stage(function, items: list, images_per_item: list) -> dict:
+    # Calls function on every item, and reports the throughput in images and
+    # the per-call latency percentiles
+    _reset_peak_rss()
+    latencies = []
+    start = time.perf_counter()
+    for item in items:
+        call_start = time.perf_counter()
+        function(item)
+        latencies.append(time.perf_counter() - call_start)
+    elapsed = time.perf_counter() - start
+    p50, p90, p99 = np.percentile(latencies, [50, 90, 99]) * 1e3
+    return {"calls": len(items), "images_per_s": sum(images_per_item) / elapsed,
+            "p50_ms": p50, "p90_ms": p90, "p99_ms": p99, "peak_rss_mb": _peak_rss_mb()}
+
+
+def _load_all_batches(dataset: ImagesDataset, batch: int) -> None:
+    for start in range(0, len(dataset), batch):
+        stacking([dataset[index] for index in range(start, min(start + batch, len(dataset)))])
+
+
+def _validate_and_load(corpus_dir: str, work_dir: str, batch: int) -> None:
+    output_dir = tempfile.mkdtemp(dir=work_dir)
+    validate_images(corpus_dir, output_dir, os.path.join(output_dir, "log.txt"))
+    _load_all_batches(ImagesDataset(output_dir), batch)
+
+
+def _benchmark_corpus(corpus_dir: str, work_dir: str, args: argparse.Namespace) -> dict:
+    image_files = sorted(os.path.join(corpus_dir, name) for name in os.listdir(corpus_dir) if name.endswith(".jpg"))
+    decoded = []
+    for image_file in image_files:
+        with Image.open(image_file) as image:
+            decoded.append(np.asarray(image))
+    grayscale = [to_grayscale(image) for image in decoded]
+    dataset = ImagesDataset(corpus_dir)
+    samples = [dataset[index] for index in range(len(dataset))]
+    batches = [samples[start:start + args.batch] for start in range(0, len(samples), args.batch)]
+
+    runs = list(range(args.repeat))
+    ones = [1] * len(image_files)
+    return {
+        "validate_images": _run_stage(
+            lambda _: validate_images(corpus_dir, tempfile.mkdtemp(dir=work_dir), os.path.join(work_dir, "log.txt")),
+            runs, [len(image_files)] * len(runs)),
+        "to_grayscale": _run_stage(to_grayscale, decoded, ones),
+        "prepare_image": _run_stage(lambda image: prepare_image(image, 100, 100, 0, 0, 32), grayscale, ones),
+        "getitem": _run_stage(dataset.__getitem__, list(range(len(dataset))), ones),
+        "stacking": _run_stage(stacking, batches, [len(batch) for batch in batches]),
+        "pipeline": _run_stage(lambda _: _validate_and_load(corpus_dir, work_dir, args.batch),
+                               runs, [len(image_files)] * len(runs)),
+    }
+
+
+def _compare(results: dict, baseline: dict, tolerance: float) -> int:
+    # Prints the throughput and p50 latency relative to the baseline, and
+    # returns the number of stages whose throughput dropped by more than
+    # tolerance
+    regressions = 0
+    print("\ncompared to the baseline (throughput / p50 latency ratio, > 1 is faster / slower):")
+    for key, result in results.items():
+        if key not in baseline["results"]:
+            print(f"{key:>40}  not in the baseline")
+            continue
+        previous = baseline["results"][key]
+        speedup = result["images_per_s"] / previous["images_per_s"]
+        latency = result["p50_ms"] / previous["p50_ms"] if previous["p50_ms"] > 0 else float("nan")
+        flag = ""
+        if speedup < 1 - tolerance:
+            flag = "  REGRESSION"
+            regressions += 1
+        print(f"{key:>40} {speedup:>7.2f}x {latency:>7.2f}x{flag}")
+    return regressions
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--images", type=int, nargs="+", default=[100],
+                    help="Numbers of images per corpus. Default: 100")
+parser.add_argument("--resolutions", type=int, nargs="+", default=[128, 512, 1024],
+                    help="Side lengths of the square images (>= 100). Default: 128 512 1024")
+parser.add_argument("--modes", nargs="+", choices=["RGB", "L"], default=["RGB", "L"],
+                    help="Image modes. Default: RGB L")
+parser.add_argument("--batch", type=int, default=32, help="Number of samples per batch. Default: 32")
+parser.add_argument("--repeat", type=int, default=3,
+                    help="Number of runs of the whole-corpus stages (validate_images, pipeline). Default: 3")
+parser.add_argument("--output", help="JSON file the results are written to")
+parser.add_argument("--compare", help="JSON file written by an earlier --output run to compare against")
+parser.add_argument("--tolerance", type=float, default=0.1,
+                    help="Throughput drop relative to --compare reported as a regression. Default: 0.1")
+args = parser.parse_args()
+
+results = {}
+print(f"{'stage':>40} {'images/s':>10} {'p50 [ms]':>9} {'p90 [ms]':>9} {'p99 [ms]':>9} {'peak RSS [MB]':>14}")
+for images in args.images:
+    for side in args.resolutions:
+        for mode in args.modes:
+            corpus = f"{mode}_{side}px_{images}"
+            with tempfile.TemporaryDirectory() as work_dir:
+                corpus_dir = os.path.join(work_dir, "corpus")
+                os.mkdir(corpus_dir)
+                write_corpus(corpus_dir, images, side, mode, duplicates=True)
+                for stage, result in _benchmark_corpus(corpus_dir, work_dir, args).items():
+                    key = f"{stage}/{corpus}"
+                    results[key] = result
+                    print(f"{key:>40} {result['images_per_s']:>10.1f} {result['p50_ms']:>9.2f} "
+                          f"{result['p90_ms']:>9.2f} {result['p99_ms']:>9.2f} {result['peak_rss_mb']:>14.1f}")
+
+report = {
+    "environment": {"python": platform.python_version(), "numpy": np.__version__, "platform": platform.platform(),
+                    "cpus": os.cpu_count()},
+    "arguments": vars(args),
+    "results": results,
+}
+if args.output is not None:
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+if args.compare is not None:
+    with open(args.compare) as f:
+        sys.exit(1 if _compare(results, json.load(f), args.tolerance) else 0)
@@ -0,0 +1,51 @@
+"""
+Compares the per-pixel Python list implementation of the variance and
+duplicate checks of ``validate_images`` with the NumPy/buffer-backed one on
+synthetic images of growing size.
+
+Usage: python bench_validation.py [--sizes 500 1000 2000] [--repeat 3]
+"""
+
+import argparse
+import os
+import sys
+import timeit
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'assignment_1'))
+from a1_ex2 import _image_digest, _image_pixels, _is_image_variance_valid
+
+
+def _list_based_checks(image: Image.Image) -> tuple[bool, int]:
+    # the implementation validate_images used before the NumPy engine
+    channel_vars = []
+    for band in range(len(image.getbands())):
+        channel = list(image.getdata(band))
+        channel_vars.append(max(channel) - min(channel))
+    return any(channel_vars), hash(tuple(image.getdata()))
+
+
+def _buffer_based_checks(image: Image.Image) -> tuple[bool, bytes]:
+    pixels = _image_pixels(image)
+    return _is_image_variance_valid(pixels), _image_digest(image, pixels)
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--sizes", type=int, nargs="+", default=[500, 1000, 2000],
+                    help="Side lengths of the square test images in pixels. Default: 500 1000 2000")
+parser.add_argument("--repeat", type=int, default=3, help="Number of timed runs per case. Default: 3")
+args = parser.parse_args()
+
+rng = np.random.default_rng(0)
+print(f"{'mode':>4} {'megapixels':>10} {'lists [s]':>10} {'numpy [s]':>10} {'speedup':>8}")
+for mode in ("RGB", "L"):
+    for side in args.sizes:
+        shape = (side, side, 3) if mode == "RGB" else (side, side)
+        image = Image.fromarray(rng.integers(0, 256, shape, dtype=np.uint8), mode=mode)
+        image.load()
+        list_time = min(timeit.repeat(lambda: _list_based_checks(image), number=1, repeat=args.repeat))
+        buffer_time = min(timeit.repeat(lambda: _buffer_based_checks(image), number=1, repeat=args.repeat))
+        print(f"{mode:>4} {side * side / 1e6:>10.2f} {list_time:>10.4f} {buffer_time:>10.4f} "
+              f"{list_time / buffer_time:>7.1f}x")
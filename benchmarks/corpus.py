@@ -0,0 +1,39 @@
+"""
+Synthetic image corpus shared by the benchmarks: smooth colour gradients with
+some noise, which compress like photos rather than like pure noise. The
+labels are in the file names (``cat000000.jpg``) for ``validate_images`` and
+in ``labels.csv`` for ``ImagesDataset``.
+"""
+
+import os
+
+import numpy as np
+from PIL import Image
+
+labels = ("cat", "dog", "bird", "fish", "horse")
+
+
+def write_corpus(image_dir: str, images: int, side: int, mode: str = "RGB", duplicates: bool = False) -> None:
+    """
+    Writes ``images`` JPEG images of ``side`` x ``side`` pixels in ``mode``
+    ('RGB' or 'L') and their ``labels.csv`` into ``image_dir``. The images
+    only depend on ``images`` and ``side``.
+
+    :param duplicates: optional flag. If ``True``, every 10th image repeats
+        the previous one, so the duplicate check of ``validate_images`` has
+        something to find.
+    """
+    rng = np.random.default_rng(images * 10000 + side)
+    y, x = np.mgrid[0:side, 0:side] / side
+    with open(os.path.join(image_dir, "labels.csv"), "w") as f:
+        f.write("name;label\n")
+        for i in range(images):
+            if not duplicates or i % 10 != 9:
+                phase = rng.random(3) * 6
+                image = np.stack([np.sin(6 * x + phase[0]), np.cos(5 * y + phase[1]),
+                                  np.sin(4 * (x + y) + phase[2])], -1)
+                image = (image * 100 + 128 + rng.normal(0, 4, image.shape)).clip(0, 255).astype(np.uint8)
+                pil_image = Image.fromarray(image).convert(mode)
+            label = labels[i % len(labels)]
+            pil_image.save(os.path.join(image_dir, f"{label}{i:06d}.jpg"), quality=85)
+            f.write(f"{label}{i:06d}.jpg;{label}\n")